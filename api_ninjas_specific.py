@@ -1,202 +1,135 @@
 import os
-import requests
-from PIL import Image, ImageDraw, ImageFont, ImageChops, ImageEnhance
-import textwrap
-import random
-
-# Function to get image paths from a directory
-def get_im_paths(dir_path):
-    return [os.path.join(dir_path, file) for file in os.listdir(dir_path) if os.path.splitext(file)[1].lower() in ['.jpg', '.jpeg', '.png']]
-
-# Function to apply a tint color to the image
-def apply_tint(im, tint_color):
-    if im.mode != 'RGB':
-        im = im.convert('RGB')
-    
-    # Create a tint image with the same size as the background image
-    tint_image = Image.new('RGB', im.size, tint_color)
-    
-    # Apply the tint
-    tinted_im = ImageChops.multiply(im, tint_image)
-    
-    # Enhance the brightness of the tinted image
-    tinted_im = ImageEnhance.Brightness(tinted_im).enhance(0.6)
-    
-    return tinted_im
-
-# Function to fetch quotes from the API
-def get_quotes_from_api(author_name, num_quotes):
+import argparse
+from bulkpost import metrics, templates
+from bulkpost.backgrounds import CACHE_DIR, DISK_CACHE_MB, add_disk_cache_arguments, prune_disk_cache
+from bulkpost.discovery import find_images
+from bulkpost.pairing import curate, spread
+from bulkpost.render_engine import resolve_workers
+from bulkpost.pipeline import Pipeline
+from bulkpost.quote_store import QuoteStore
+from bulkpost.quote_sources import ApiNinjasSource, API_NINJAS_URL, iter_quotes
+from bulkpost.encoders import OutputFormat, add_format_arguments, format_from_args, write_file
+from bulkpost.assets import format_stats
+from bulkpost.jobs import RENDER_VERSION
+from bulkpost.manifest import post_digest, post_file_name
+from bulkpost.templates import DEFAULT_TEMPLATE, load_template, disabled_roles
+
+INPUT_DIR = "in/raw"
+OUTPUT_DIR = "out"
+
+# Function to get image paths from a directory, checked from their headers.
+# Near-duplicates and backgrounds the quote would be hard to read on are left out.
+def get_im_paths(dir_path, template_path=DEFAULT_TEMPLATE):
+    im_paths, _ = curate(find_images(dir_path), load_template(template_path))
+    return im_paths
+
+# Function to stream quotes as they arrive, starting with those already in the quote store
+def iter_quotes_from_api(author_name, num_quotes, base_url=API_NINJAS_URL, store=None, offline=None):
     api_key = 'YOUR_API_KEY'  # Replace with your actual API key from https://www.api-ninjas.com/
-    quotes = []
-    try:
-        for _ in range(num_quotes):
-            url = f'https://api.api-ninjas.com/v1/quotes?author={author_name}'
-            headers = {'X-Api-Key': api_key}
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                data = response.json()
-                if data:
-                    quotes.append(f"{data[0]['quote']} - {author_name}")
-                else:
-                    print("No quote returned in API response.")
-            else:
-                print(f"Failed to fetch quote. HTTP {response.status_code}: {response.text}")
-        return quotes
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching quotes from API: {e}")
-        return []
-
-# Function to resize the logo
-def resize_logo(logo, max_width, image_width):
-    logo_width, logo_height = logo.size
-    if logo_width > max_width:
-        aspect_ratio = logo_height / logo_width
-        new_height = int(max_width * aspect_ratio)
-        logo = logo.resize((max_width, new_height), Image.Resampling.LANCZOS)
-    return logo
-
-# Function to place the quote in the center of the image
-def place_quote(im, quote, font):
-    draw = ImageDraw.Draw(im)
-    W, H = im.size
-    lines = textwrap.wrap(quote, width=24)
-    n_lines = len(lines)
-    pad = -10
-    current_h = H / 2 - (n_lines * draw.textbbox((0, 0), lines[0], font=font)[3] / 2)
-    for line in lines:
-        text_width, text_height = draw.textbbox((0, 0), line, font=font)[2:]
-        draw.text(((W - text_width) / 2, current_h), line, font=font, fill="white")
-        current_h += text_height + pad
-
-# Function to place trademark at the bottom of the image
-def place_trademark(im, trademark, font):
-    draw = ImageDraw.Draw(im)
-    W, H = im.size
-    text_width, text_height = draw.textbbox((0, 0), trademark, font=font)[2:]
-    x = (W - text_width) / 2
-    y = H - text_height - 10  # 10 pixels from the bottom
-    draw.text((x, y), trademark, font=font, fill="white")
-    return im
-
-# Function to place logo at the bottom-center of the image
-def place_logo(im, logo, trademark, font):
-    W, H = im.size
-    logo_width, logo_height = logo.size
-    draw = ImageDraw.Draw(im)
-    text_width, text_height = draw.textbbox((0, 0), trademark, font=font)[2:]
-    spacing = 10  # Increase spacing to give room for the logo
-    
-    # Resize the logo to a smaller size (e.g., 15% of the image width)
-    logo_size = int(W * 0.2)  # 20% of the background image width
-    logo = logo.resize((logo_size, int(logo.size[1] * logo_size / logo.size[0])), Image.Resampling.LANCZOS)
-    logo_width, logo_height = logo.size
-    
-    # Center the logo horizontally and place it near the bottom with extra space for the trademark
-    x_position = (W - logo_width) // 2
-    y_position = H - logo_height - text_height - spacing  # Place it above the trademark
-
-    # Ensure logo has an alpha channel for transparency handling
-    logo = logo.convert("RGBA")
-    im.paste(logo, (x_position, y_position), logo)  # Use logo as the mask for transparency
-    return im
+    source = ApiNinjasSource(author_name, api_key, base_url)
+    return iter_quotes(source, num_quotes, store=store, offline=offline)
+
+# Function to render one post in memory from a template (background, quote, cached static overlay)
+def render_post(im_path, selected_quote, add_logo, add_trademark, template_path=DEFAULT_TEMPLATE, cache_dir=CACHE_DIR):
+    template = load_template(template_path)
+    return templates.render_post(im_path, selected_quote, template, disabled_roles(add_logo, add_trademark), cache_dir)
+
+# Function to write an encoded post
+def save_post(data, file_name):
+    write_file(os.path.join(OUTPUT_DIR, file_name), data)
+    print(f"Output image saved as: {os.path.join(OUTPUT_DIR, file_name)}")
+    return os.path.join(OUTPUT_DIR, file_name)
+
+# Function to build and save one post
+def build_image(im_path, selected_quote, file_name, add_logo, add_trademark, fmt=None, template_path=DEFAULT_TEMPLATE):
+    fmt = fmt or OutputFormat()
+    im = render_post(im_path, selected_quote, add_logo, add_trademark, template_path)
+    return save_post(fmt.encode(im), file_name)
+
+# Function to render and encode one post in a worker process; writing happens back in the main process
+def encode_job(im_path, selected_quote, add_logo, add_trademark, fmt, template_path, cache_dir, file_name):
+    return fmt.encode(render_post(im_path, selected_quote, add_logo, add_trademark, template_path, cache_dir))
+
+# Function to write one render result; returns whether the post was saved
+def save_result(result):
+    im_path, selected_quote = result.job[:2]
+    file_name = result.job[-1]
+    if result.error:
+        print(f"Failed to build {im_path} with quote: {selected_quote} ({result.error})")
+        return False
+    save_post(result.output, file_name)
+    return True
 
 # Main function to orchestrate the process
-def main():
-    input_dir = "in/raw"
-    output_dir = "out"
-    cap_font_path = "utils/BebasNeue.otf"
-    tm_font_path = "utils/BebasNeue.otf"
-    logo_path = "shelby.png"
-    W, H = 1080, 1080
-
-    im_paths = get_im_paths(input_dir)
+def main(workers=1, progress_interval=None, offline=None, fmt=None, template_path=DEFAULT_TEMPLATE, cache_dir=CACHE_DIR,
+         cache_mb=DISK_CACHE_MB):
+    im_paths = get_im_paths(INPUT_DIR, template_path)
 
     if not im_paths:
-        print(f"No image files found in {input_dir}. Exiting...")
+        print(f"No image files found in {INPUT_DIR}. Exiting...")
         return
 
     author_name = input("Enter author's name (e.g., Aristotle): ").strip()
     num_quotes = int(input("How many quotes would you like to fetch? ").strip())
-    quotes = get_quotes_from_api(author_name, num_quotes)
-
-    if not quotes:
-        print(f"No quotes found for author '{author_name}'. Exiting...")
-        return
-
-    quotes = [' '.join(quote.split()[:20]) for quote in quotes]  # Limit quotes to 20 words
     generate_all_combinations = input("Generate all combinations? (y/n): ").strip().lower() == 'y'
     add_logo = input("Include logo? (y/n): ").strip().lower() == 'y'
     add_trademark = input("Include trademark? (y/n): ").strip().lower() == 'y'
-
-    for i, selected_quote in enumerate(quotes):
-        if generate_all_combinations:
-            im_count = 0
-            for im_path in im_paths:
-                print(f"Overlaying {im_path} with quote: {selected_quote}")
-                im = Image.open(im_path).resize((W, H))
-                im = apply_tint(im, (200, 200, 200))  # Apply the tint
-
-                draw = ImageDraw.Draw(im)
-                cap_font = ImageFont.truetype(cap_font_path, 115)
-
-                # Place the quote
-                place_quote(im, selected_quote, cap_font)
-
-                # Place trademark if necessary
-                if add_trademark:
-                    trademark = "YOUR_TRADEMARK"
-                    tm_font = ImageFont.truetype(tm_font_path, 52)
-                    place_trademark(im, trademark, tm_font)
-
-                # Place logo if necessary
-                if add_logo and logo_path:
-                    try:
-                        logo = Image.open(logo_path).convert("RGBA")
-                        logo = resize_logo(logo, W // 5, W)  # Resize logo to max 1/5th of image width
-                        im = place_logo(im, logo, trademark, tm_font)
-                    except FileNotFoundError:
-                        print(f"Logo file not found at {logo_path}. Skipping logo placement.")
-                    except Exception as e:
-                        print(f"Error placing logo: {e}")
-
-                os.makedirs(output_dir, exist_ok=True)
-                file_name = f"{im_count}_{selected_quote[:10].replace(' ', '_')}.png"
-                im.save(os.path.join(output_dir, file_name), format='PNG', quality=95)
-                print(f"Output image saved as: {os.path.join(output_dir, file_name)}")
-                im_count += 1
-        else:
-            im_path = random.choice(im_paths)
+    fmt = fmt or OutputFormat()
+    # Posts are named after a digest of their inputs, so quotes sharing their first words never overwrite each other
+    template = load_template(template_path)
+    params = {"version": RENDER_VERSION, "template": template.digest(),
+              "disabled": sorted(disabled_roles(add_logo, add_trademark)), "output": fmt.params()}
+
+    # Pair each quote with its background(s) as soon as it arrives. Single backgrounds are
+    # spread out: every image is used once before any is picked again.
+    backgrounds = spread(im_paths)
+
+    def pair(selected_quote):
+        selected_quote = ' '.join(selected_quote.split()[:20])  # Limit quotes to 20 words
+        for im_path in im_paths if generate_all_combinations else [next(backgrounds)]:
             print(f"Overlaying {im_path} with quote: {selected_quote}")
-            im = Image.open(im_path).resize((W, H))
-            im = apply_tint(im, (200, 200, 200))  # Apply the tint
-
-            draw = ImageDraw.Draw(im)
-            cap_font = ImageFont.truetype(cap_font_path, 115)
-
-            # Place the quote
-            place_quote(im, selected_quote, cap_font)
-
-            # Place trademark if necessary
-            if add_trademark:
-                trademark = "YOUR_TRADEMARK"
-                tm_font = ImageFont.truetype(tm_font_path, 52)
-                place_trademark(im, trademark, tm_font)
-
-            # Place logo if necessary
-            if add_logo and logo_path:
-                try:
-                    logo = Image.open(logo_path).convert("RGBA")
-                    logo = resize_logo(logo, W // 5, W)  # Resize logo to max 1/5th of image width
-                    im = place_logo(im, logo, trademark, tm_font)
-                except FileNotFoundError:
-                    print(f"Logo file not found at {logo_path}. Skipping logo placement.")
-                except Exception as e:
-                    print(f"Error placing logo: {e}")
-
-            os.makedirs(output_dir, exist_ok=True)
-            file_name = f"{i}_{selected_quote[:10].replace(' ', '_')}.png"
-            im.save(os.path.join(output_dir, file_name), format='PNG', quality=95)
-            print(f"Output image saved as: {os.path.join(output_dir, file_name)}")
+            digest = post_digest(im_path, selected_quote, template.quote["font"], None, params)
+            file_name = post_file_name(selected_quote, digest, fmt.ext)
+            yield (im_path, selected_quote, add_logo, add_trademark, fmt, template_path, cache_dir, file_name)
+
+    # Stream quotes -> pair them with backgrounds -> render and encode on worker processes ->
+    # write on a thread, so network time overlaps with rendering and rendering with disk writes
+    workers = resolve_workers(workers)
+    store = QuoteStore()  # Quotes already fetched for this author are not paid for again
+    quotes = iter_quotes_from_api(author_name, num_quotes, store=store, offline=offline)
+    pipeline = Pipeline(quotes, name="fetch")
+    pipeline.add_stage("pair", pair, expand=True)
+    pipeline.add_pool_stage("render", encode_job, workers)
+    pipeline.add_stage("write", save_result)
+    if progress_interval:
+        pipeline.monitor(progress_interval)
+    results = list(pipeline.run())
+    saved, failed = results.count(True), results.count(False) + pipeline.stages[-1].errors
+    metrics.count("bulkpost_posts_total", saved, status="rendered")
+    metrics.count("bulkpost_posts_total", failed, status="failed")
+    if cache_dir:
+        prune_disk_cache(cache_dir, cache_mb)
+
+    if not pipeline.source_stage.processed:
+        print(f"No quotes found for author '{author_name}'. Exiting...")
+        return
+    print(f"Saved {saved} posts, failed {failed} ({workers} render processes)")
+    print(pipeline.format_stats())
+    if workers == 1:  # Worker processes keep their own caches
+        print(f"Asset cache: {format_stats()}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Overlay quotes from API Ninjas onto images in in/raw")
+    parser.add_argument("--workers", type=int, default=1, help="number of render processes (0 = one per core)")
+    parser.add_argument("--offline", action="store_true", default=None,
+                        help="use only quotes already in the local quote store")
+    parser.add_argument("--progress", type=float, default=None, metavar="SECONDS",
+                        help="print per-stage queue depth and throughput every SECONDS")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, help="template file describing the post layout")
+    add_format_arguments(parser)
+    add_disk_cache_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+    metrics.metrics_from_args(args)
+    main(args.workers, args.progress, args.offline, format_from_args(args), args.template,
+         None if args.no_disk_cache else CACHE_DIR, args.disk_cache_mb or DISK_CACHE_MB)
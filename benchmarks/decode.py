@@ -0,0 +1,85 @@
+# Benchmark: decode time, peak RSS and accuracy of the background loader on large JPEGs
+#
+#   python benchmarks/decode.py --width 6000 --height 4000
+import argparse
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from PIL import Image, ImageChops, ImageStat
+
+from bulkpost.backgrounds import load_background
+
+CASES = {
+    "open + resize (original)": lambda path, size: Image.open(path).resize(size),
+    "exact crop-to-fill": lambda path, size: load_background(path, size, draft_margin=0, reducing_gap=None),
+    "draft + reducing_gap (default)": lambda path, size: load_background(path, size),
+    "draft margin 1.0": lambda path, size: load_background(path, size, draft_margin=1.0),
+}
+
+# Function to run one case in this process, save its output and print its median time and peak RSS
+def run_case(name, path, size, repeat, out_path):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = CASES[name](path, size)
+        timings.append((time.perf_counter() - start) * 1000)
+    peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result.convert("RGB").save(out_path)
+    print(f"{statistics.median(timings)} {peak_kib}")
+
+# Function to run this script in a fresh interpreter. Peak RSS survives fork and exec on Linux,
+# so the parent never touches large images itself.
+def run_child(*args):
+    return subprocess.run([sys.executable, __file__, *args], capture_output=True, text=True, check=True).stdout
+
+# Function to write a synthetic camera-sized JPEG with some fine detail
+def make_jpeg(path, size):
+    detail = Image.effect_noise((size[0] // 8, size[1] // 8), 90).convert("RGB").resize(size, Image.Resampling.BICUBIC)
+    grain = Image.effect_noise(size, 25).convert("RGB")
+    ImageChops.add(detail, grain, scale=1.6).save(path, quality=92)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure background decode cost on large JPEGs")
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--target", type=int, nargs=2, default=(1080, 1080))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", nargs=3, metavar=("CASE", "PATH", "OUT"), help=argparse.SUPPRESS)
+    parser.add_argument("--make", metavar="PATH", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    size = tuple(args.target)
+
+    if args.make:
+        make_jpeg(args.make, (args.width, args.height))
+        return
+    if args.child:
+        run_case(args.child[0], args.child[1], size, args.repeat, args.child[2])
+        return
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, "large.jpg")
+        run_child("--width", str(args.width), "--height", str(args.height), "--make", path)
+        rows = []
+        for i, name in enumerate(CASES):
+            out_path = os.path.join(work_dir, f"{i}.png")
+            output = run_child("--repeat", str(args.repeat), "--target", *map(str, size),
+                               "--child", name, path, out_path).split()
+            rows.append((name, float(output[0]), int(output[1]), out_path))
+
+        exact = Image.open(next(row[3] for row in rows if row[0] == "exact crop-to-fill"))
+        print(f"{args.width}x{args.height} JPEG -> {size[0]}x{size[1]}")
+        print(f"{'loader':<32} {'ms':>8} {'peak RSS MiB':>13} {'mean error':>11}")
+        for name, ms, peak_kib, out_path in rows:
+            error = statistics.mean(ImageStat.Stat(ImageChops.difference(exact, Image.open(out_path))).mean)
+            print(f"{name:<32} {ms:>8.1f} {peak_kib / 1024:>13.1f} {error:>11.2f}")
+
+if __name__ == "__main__":
+    main()
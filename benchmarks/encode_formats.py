@@ -0,0 +1,46 @@
+# Benchmark: encode time and output size per post for each output format
+#
+#   python benchmarks/encode_formats.py --repeat 5
+import argparse
+import os
+import statistics
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.chdir(REPO_ROOT)
+
+import post_generator
+from bulkpost.encoders import OutputFormat
+
+CANDIDATES = [
+    ("png level 1", OutputFormat("png", compress_level=1)),
+    ("png level 6 (default)", OutputFormat("png", compress_level=6)),
+    ("png level 9", OutputFormat("png", compress_level=9)),
+    ("jpeg q85", OutputFormat("jpeg", quality=85)),
+    ("jpeg q95", OutputFormat("jpeg", quality=95)),
+    ("webp q80", OutputFormat("webp", quality=80)),
+    ("webp q90 method 0", OutputFormat("webp", quality=90, method=0)),
+    ("webp lossless", OutputFormat("webp", lossless=True, quality=50)),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare encode speed and size of the output formats")
+    parser.add_argument("--background", default=os.path.join("in", "raw", "images.jpg"))
+    parser.add_argument("--quote", default="Whisky's good proofing water. Tells you who's real and who isn't.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    im = post_generator.render_post(args.background, args.quote, True, True)
+    print(f"{'format':<24} {'encode ms':>10} {'KiB/post':>10}")
+    for name, fmt in CANDIDATES:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            data = fmt.encode(im)
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{name:<24} {statistics.median(timings):>10.1f} {len(data) / 1024:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# Benchmark: quote layout throughput and width-cache hit rate over a batch of quotes
+#
+#   python benchmarks/layout.py --quotes 10000
+import argparse
+import os
+import random
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.chdir(REPO_ROOT)
+
+from bulkpost import layout
+
+WORDS = ("the only way to do great work is love what you never settle real who isn't whisky good "
+         "proofing water tells strength courage wisdom time life people success failure dream").split()
+
+def main():
+    parser = argparse.ArgumentParser(description="Lay out a batch of synthetic quotes")
+    parser.add_argument("--quotes", type=int, default=10000)
+    parser.add_argument("--font", default="utils/BebasNeue.otf")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    quotes = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 40))) for _ in range(args.quotes)]
+    words = sum(len(quote.split()) for quote in quotes)
+
+    start = time.perf_counter()
+    for quote in quotes:
+        layout.layout_quote(quote, args.font, (1080, 1080))
+    elapsed = time.perf_counter() - start
+
+    lookups = layout.stats["hits"] + layout.stats["misses"]
+    print(f"{args.quotes} quotes, {words} words in {elapsed:.2f}s ({args.quotes / elapsed:.0f} layouts/s)")
+    print(f"width lookups: {lookups} ({lookups / words:.1f} per word), "
+          f"FreeType measurements: {layout.stats['misses']}")
+
+if __name__ == "__main__":
+    main()
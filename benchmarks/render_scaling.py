@@ -0,0 +1,81 @@
+# Benchmark: render throughput of the process pool at 1, 2, 4 ... N workers
+#
+#   python benchmarks/render_scaling.py --images 8 --quotes 16 --max-workers 8
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from PIL import Image
+
+import post_generator
+from bulkpost import backgrounds
+from bulkpost.render_engine import render_jobs, resolve_workers
+
+QUOTE = "The only way to do great work is to love what you do and never settle - Steve Jobs"
+
+# Function to render one post without the per-image progress lines
+def quiet_build(*job):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return post_generator.build_image(*job)
+
+# Function to write synthetic camera-sized backgrounds into a directory
+def make_backgrounds(dir_path, count, size):
+    paths = []
+    for i in range(count):
+        path = os.path.join(dir_path, f"bg_{i}.jpg")
+        Image.effect_noise(size, 60 + i).convert("RGB").save(path, quality=90)
+        paths.append(path)
+    return paths
+
+# Function to get the worker counts to measure: powers of two up to max_workers, plus max_workers
+def worker_counts(max_workers):
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure render throughput at increasing worker counts")
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--quotes", type=int, default=8)
+    parser.add_argument("--max-workers", type=int, default=0, help="0 = one per core")
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--height", type=int, default=1500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Templates, fonts and the logo are loaded by relative path
+        os.symlink(os.path.join(REPO_ROOT, "templates"), os.path.join(work_dir, "templates"))
+        os.symlink(os.path.join(REPO_ROOT, "utils"), os.path.join(work_dir, "utils"))
+        os.symlink(os.path.join(REPO_ROOT, "shelby.png"), os.path.join(work_dir, "shelby.png"))
+        os.chdir(work_dir)
+        im_paths = make_backgrounds(work_dir, args.images, (args.width, args.height))
+        quotes = [f"{i} {QUOTE}" for i in range(args.quotes)]
+        jobs = [(im_path, quote, n, True, True) for n, im_path in enumerate(im_paths) for quote in quotes]
+
+        print(f"{len(jobs)} posts per run ({args.images} images x {args.quotes} quotes)")
+        print(f"{'workers':>8} {'seconds':>9} {'posts/s':>9} {'speedup':>8}")
+        baseline = None
+        for workers in worker_counts(resolve_workers(args.max_workers)):
+            backgrounds.clear_cache()
+            start = time.perf_counter()
+            errors = [result.error for result in render_jobs(quiet_build, jobs, workers) if result.error]
+            elapsed = time.perf_counter() - start
+            if errors:  # Timings of failed renders would be meaningless
+                sys.exit(f"{len(errors)} of {len(jobs)} posts failed with {workers} workers, e.g. {errors[0]}")
+            rate = len(jobs) / elapsed
+            baseline = baseline or rate
+            print(f"{workers:>8} {elapsed:>9.2f} {rate:>9.1f} {rate / baseline:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# Benchmark: fused lookup-table tint against the original multiply + brightness passes
+#
+#   python benchmarks/tint.py --size 1080 --repeat 20
+import argparse
+import os
+import statistics
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from PIL import Image, ImageChops
+
+from bulkpost.tint import apply_tint, reference_tint
+
+# Function to get the median run time of fn in milliseconds
+def median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the fused tint with the original two-pass tint")
+    parser.add_argument("--size", type=int, default=1080)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--tint", type=int, nargs=3, default=(200, 200, 200))
+    parser.add_argument("--brightness", type=float, default=0.6)
+    args = parser.parse_args()
+
+    im = Image.effect_noise((args.size, args.size), 80).convert("RGB")
+    tint_color = tuple(args.tint)
+    identical = ImageChops.difference(reference_tint(im, tint_color, args.brightness),
+                                      apply_tint(im, tint_color, args.brightness)).getbbox() is None
+    cases = [
+        ("multiply + brightness", lambda: reference_tint(im, tint_color, args.brightness)),
+        ("fused lookup table", lambda: apply_tint(im, tint_color, args.brightness)),
+        ("fused + gradient + vignette", lambda: apply_tint(im, tint_color, args.brightness,
+                                                           ((255, 255, 255), (120, 120, 160)), 0.5)),
+    ]
+    print(f"{args.size}x{args.size}, pixel-identical: {identical}")
+    baseline = None
+    for name, fn in cases:
+        ms = median_ms(fn, args.repeat)
+        baseline = baseline or ms
+        print(f"{name:<30} {ms:>8.2f} ms {baseline / ms:>6.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+from PIL import Image, ImageDraw, ImageFont
+
+# Process-wide registry of fonts, logos and text measurements.
+# Every render process loads each asset once; stats counts hits and misses per kind.
+_fonts = {}
+_logos = {}
+_logo_sizes = {}
+_text_sizes = {}
+_measure = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+
+stats = {
+    "fonts": {"hits": 0, "misses": 0},
+    "logos": {"hits": 0, "misses": 0},
+    "text": {"hits": 0, "misses": 0},
+}
+
+# Function to look up a cached value, counting the hit or miss
+def _lookup(cache, kind, key):
+    value = cache.get(key)
+    stats[kind]["hits" if value is not None else "misses"] += 1
+    return value
+
+# Function to get a TrueType font, loading each (path, size) once
+def get_font(path, size):
+    key = (path, size)
+    font = _lookup(_fonts, "fonts", key)
+    if font is None:
+        font = _fonts[key] = ImageFont.truetype(path, size)
+    return font
+
+# Function to get the original (width, height) of a logo file
+def get_logo_size(path):
+    size = _logo_sizes.get(path)
+    if size is None:
+        with Image.open(path) as logo:
+            size = _logo_sizes[path] = logo.size
+    return size
+
+# Function to get a logo resized to size, with its alpha mask already split off
+def get_logo(path, size, resample=Image.Resampling.LANCZOS):
+    key = (path, tuple(size), resample)
+    entry = _lookup(_logos, "logos", key)
+    if entry is None:
+        with Image.open(path) as logo:
+            logo = logo.convert("RGBA").resize(tuple(size), resample)
+        entry = _logos[key] = (logo, logo.split()[3])
+    return entry
+
+# Function to measure text the way draw.textbbox((0, 0), text, font=font)[2:] does
+def text_size(text, font):
+    key = (getattr(font, "path", id(font)), getattr(font, "size", None), text)
+    size = _lookup(_text_sizes, "text", key)
+    if size is None:
+        size = _text_sizes[key] = tuple(_measure.textbbox((0, 0), text, font=font)[2:])
+    return size
+
+# Function to format the hit/miss counters for a log line
+def format_stats():
+    return ", ".join(f"{kind} {c['hits']} hits/{c['misses']} misses" for kind, c in stats.items())
+
+# Function to drop every cached asset and reset the counters
+def clear_cache():
+    for cache in (_fonts, _logos, _logo_sizes, _text_sizes):
+        cache.clear()
+    for counters in stats.values():
+        counters["hits"] = counters["misses"] = 0
@@ -0,0 +1,225 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+from bulkpost import metrics
+from bulkpost.tint import apply_tint, DEFAULT_TINT, DEFAULT_BRIGHTNESS
+
+DEFAULT_SIZE = (1080, 1080)
+
+# How a background is fitted to the canvas: "crop" fills it keeping the aspect ratio, "stretch" distorts
+DEFAULT_FIT = "crop"
+# JPEGs are DCT-scaled while decoding, but never below DRAFT_MARGIN x the size that is finally
+# needed (0 disables draft decoding). Resizing first reduces by whole factors while the image
+# stays at least REDUCING_GAP x the target (None resamples the full image, the exact result).
+DRAFT_MARGIN = 1.5
+REDUCING_GAP = 3.0
+
+CACHE_DIR = os.path.join(".cache", "backgrounds")
+# Size cap of the on-disk cache; the least recently used backgrounds are deleted beyond it
+DISK_CACHE_MB = 2048
+
+# Upper bound on prepared backgrounds kept in memory. Pillow stores RGB at 4 bytes per pixel,
+# so each is ~4.5MB at 1080x1080 (see memory.frame_mb) and a full cache is ~1.1GB.
+# Runs with several workers split it between them (see memory.plan_memory).
+MAX_CACHED = 256
+
+_prepared = OrderedDict()
+_lock = threading.Lock()
+stats = {"hits": 0, "misses": 0, "disk_hits": 0}
+
+# Function to get the centered region of a (width, height) image that has the target's aspect ratio
+def crop_box(src_size, size):
+    src_w, src_h = src_size
+    w, h = size
+    if src_w * h > w * src_h:  # Source is wider than the target
+        crop_w = src_h * w / h
+        return ((src_w - crop_w) / 2, 0, (src_w + crop_w) / 2, src_h)
+    crop_h = src_w * h / w
+    return (0, (src_h - crop_h) / 2, src_w, (src_h + crop_h) / 2)
+
+# Function to decode a background once for several canvas sizes, close to the largest of them.
+# Returns the decoded image and, per size, the region of it to resize to that canvas.
+def decode_for_sizes(im_path, sizes, fit=DEFAULT_FIT, draft_margin=DRAFT_MARGIN):
+    sizes = [tuple(size) for size in sizes]
+    with Image.open(im_path) as src:
+        boxes = [crop_box(src.size, size) if fit == "crop" else (0, 0) + src.size for size in sizes]
+        if draft_margin and src.format == "JPEG":
+            # Ask the decoder for the smallest scale whose cropped regions still cover every target
+            full_size = src.size
+            request = (0, 0)
+            for size, box in zip(sizes, boxes):
+                scale_x = size[0] / (box[2] - box[0])
+                scale_y = size[1] / (box[3] - box[1])
+                request = (max(request[0], int(full_size[0] * scale_x * draft_margin)),
+                           max(request[1], int(full_size[1] * scale_y * draft_margin)))
+            src.draft('RGB', request)
+            if src.size != full_size:
+                ratio_x, ratio_y = src.size[0] / full_size[0], src.size[1] / full_size[1]
+                boxes = [(box[0] * ratio_x, box[1] * ratio_y, box[2] * ratio_x, box[3] * ratio_y) for box in boxes]
+        src.load()
+        return src, boxes
+
+# Function to decode a background close to its target size.
+# Returns the decoded image and the region of it to resize to the canvas.
+def decode_background(im_path, size=DEFAULT_SIZE, fit=DEFAULT_FIT, draft_margin=DRAFT_MARGIN):
+    im, boxes = decode_for_sizes(im_path, [size], fit, draft_margin)
+    return im, boxes[0]
+
+# Function to resize the decoded region of a background to the canvas
+def fit_background(im, box, size=DEFAULT_SIZE, reducing_gap=REDUCING_GAP):
+    return im.resize(tuple(size), Image.Resampling.BICUBIC, box=box, reducing_gap=reducing_gap)
+
+# Function to decode a background close to its target size and fit it to the canvas
+def load_background(im_path, size=DEFAULT_SIZE, fit=DEFAULT_FIT, draft_margin=DRAFT_MARGIN,
+                    reducing_gap=REDUCING_GAP):
+    im, box = decode_background(im_path, size, fit, draft_margin)
+    return fit_background(im, box, size, reducing_gap)
+
+# Function to build the cache key identifying a prepared background
+def background_key(im_path, size=DEFAULT_SIZE, tint_color=DEFAULT_TINT, brightness=DEFAULT_BRIGHTNESS,
+                   gradient=None, vignette=0.0, fit=DEFAULT_FIT):
+    st = os.stat(im_path)
+    key = (os.path.abspath(im_path), st.st_mtime_ns, st.st_size, tuple(size), tuple(tint_color), brightness,
+           fit, DRAFT_MARGIN, REDUCING_GAP)
+    if gradient or vignette:
+        key += (tuple(map(tuple, gradient)) if gradient else None, vignette)
+    return key
+
+# Function to get the on-disk location of a prepared background
+def _disk_path(cache_dir, key):
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f"{digest}.raw")
+
+# Function to load a prepared background from the on-disk cache
+def _load_from_disk(path, size):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) != size[0] * size[1] * 3:
+        return None
+    try:
+        os.utime(path)  # Marks it recently used for prune_disk_cache
+    except OSError:
+        pass
+    return Image.frombytes('RGB', size, data)
+
+# Function to write a prepared background to the on-disk cache
+def _save_to_disk(path, im):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(im.tobytes())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error writing background cache: {e}")
+
+# Function to shrink the on-disk cache to max_mb, deleting the least recently used backgrounds first.
+# Returns the number of files removed.
+def prune_disk_cache(cache_dir=CACHE_DIR, max_mb=DISK_CACHE_MB):
+    entries = []
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.raw'):
+                    try:
+                        st = entry.stat()
+                    except OSError:  # Removed by another process meanwhile
+                        continue
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        print(f"Error listing background cache: {e}")
+        return 0
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_mb * 2**20:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+# Function to add the on-disk cache options to an argparse parser
+def add_disk_cache_arguments(parser):
+    parser.add_argument("--no-disk-cache", action="store_true",
+                        help=f"keep prepared backgrounds in memory only, not in {CACHE_DIR}")
+    parser.add_argument("--disk-cache-mb", type=float, metavar="MB",
+                        help=f"size cap of {CACHE_DIR} (default {DISK_CACHE_MB})")
+
+# Function to look a prepared background up in memory, then on disk
+def _lookup(key, size, disk_path):
+    with _lock:
+        im = _prepared.get(key)
+        if im is not None:
+            _prepared.move_to_end(key)
+            stats["hits"] += 1
+            metrics.count("bulkpost_background_cache_total", result="hit")
+            return im
+    im = _load_from_disk(disk_path, tuple(size)) if disk_path else None
+    if im is not None:
+        stats["disk_hits"] += 1
+        metrics.count("bulkpost_background_cache_total", result="disk")
+        _remember(key, im)
+    return im
+
+# Function to keep a prepared background in memory, dropping the least recently used
+def _remember(key, im):
+    with _lock:
+        _prepared[key] = im
+        while len(_prepared) > MAX_CACHED:
+            _prepared.popitem(last=False)
+
+# Function to decode, resize and tint a background, reusing earlier work when possible.
+# The returned image is shared, callers that draw on it must use get_background instead.
+def prepare_background(im_path, size=DEFAULT_SIZE, tint_color=DEFAULT_TINT,
+                       brightness=DEFAULT_BRIGHTNESS, cache_dir=None, gradient=None, vignette=0.0,
+                       fit=DEFAULT_FIT):
+    return prepare_backgrounds(im_path, [size], tint_color, brightness, cache_dir, gradient, vignette, fit)[0]
+
+# Function to prepare a background for several canvas sizes at once.
+# Sizes missing from the caches share a single decode; each is then resized and tinted on its own.
+def prepare_backgrounds(im_path, sizes, tint_color=DEFAULT_TINT, brightness=DEFAULT_BRIGHTNESS,
+                        cache_dir=None, gradient=None, vignette=0.0, fit=DEFAULT_FIT):
+    keys = [background_key(im_path, size, tint_color, brightness, gradient, vignette, fit) for size in sizes]
+    disk_paths = [_disk_path(cache_dir, key) if cache_dir else None for key in keys]
+    prepared = [_lookup(key, size, disk_path) for key, size, disk_path in zip(keys, sizes, disk_paths)]
+    missing = [i for i, im in enumerate(prepared) if im is None]
+    if missing:
+        with metrics.timed("bulkpost_background_seconds"):
+            decoded, boxes = decode_for_sizes(im_path, [sizes[i] for i in missing], fit)
+            for i, box in zip(missing, boxes):
+                stats["misses"] += 1
+                metrics.count("bulkpost_background_cache_total", result="miss")
+                im = apply_tint(fit_background(decoded, box, sizes[i]), tint_color, brightness, gradient, vignette)
+                if disk_paths[i]:
+                    _save_to_disk(disk_paths[i], im)
+                _remember(keys[i], im)
+                prepared[i] = im
+    return prepared
+
+# Function to get a private, drawable copy of a prepared background.
+# With out (an RGB image of the same size), the pixels are copied into it instead of a new image.
+def get_background(im_path, size=DEFAULT_SIZE, tint_color=DEFAULT_TINT,
+                   brightness=DEFAULT_BRIGHTNESS, cache_dir=None, gradient=None, vignette=0.0,
+                   fit=DEFAULT_FIT, out=None):
+    im = prepare_background(im_path, size, tint_color, brightness, cache_dir, gradient, vignette, fit)
+    if out is not None and out.size == im.size and out.mode == im.mode:
+        out.paste(im, (0, 0))
+        return out
+    return im.copy()
+
+# Function to drop every prepared background held in memory
+def clear_cache():
+    with _lock:
+        _prepared.clear()
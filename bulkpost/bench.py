@@ -0,0 +1,182 @@
+import json
+import math
+import os
+import platform
+import random
+import tempfile
+import time
+
+import PIL
+from PIL import Image
+
+from bulkpost import backgrounds, templates, tint
+from bulkpost.assets import get_font, get_logo, get_logo_size
+from bulkpost.drawing import place_quote, place_trademark, place_logo, LOGO_WIDTH
+from bulkpost.encoders import OutputFormat
+from bulkpost.memory import current_rss, peak_rss
+from bulkpost.render_engine import render_jobs, resolve_workers
+from bulkpost.templates import DEFAULT_TEMPLATE, load_template
+
+REPORT_VERSION = 1
+STAGES = ("decode", "resize", "tint", "place_quote", "trademark", "logo", "save")
+DEFAULT_SIZES = ((1080, 1080), (1920, 1080), (4000, 3000))
+DEFAULT_TOLERANCE = 0.15  # Slowdown against a baseline that counts as a regression
+FONT_PATH = os.path.join("utils", "BebasNeue.otf")
+LOGO_PATH = "shelby.png"
+TRADEMARK = "YOUR_TRADEMARK"
+WORDS = ("the only way to do great work is to love what you do and never settle for less than "
+         "your best because life is short and every moment counts towards something").split()
+
+# Function to get the nearest-rank percentile of sorted samples
+def percentile(samples, p):
+    return samples[max(0, math.ceil(p * len(samples)) - 1)]
+
+# Timings and memory readings for one stage of the render path
+class StageTimer:
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+        self.peak_rss = 0
+        self.images_allocated = 0
+
+    # Function to run fn(*args) once, recording its time, the RSS after it and Pillow's image allocations
+    def run(self, fn, *args):
+        allocated = Image.core.get_stats()["new_count"]
+        start = time.perf_counter()
+        result = fn(*args)
+        self.samples.append(time.perf_counter() - start)
+        self.images_allocated += Image.core.get_stats()["new_count"] - allocated
+        self.peak_rss = max(self.peak_rss, current_rss() or 0)
+        return result
+
+    def report(self):
+        samples = sorted(self.samples)
+        return {
+            "count": len(samples),
+            "p50_ms": round(percentile(samples, 0.5) * 1000, 3),
+            "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+            "total_s": round(sum(samples), 4),
+            "peak_rss_mb": round(self.peak_rss / 2**20, 1) if self.peak_rss else None,
+            "images_allocated_per_op": round(self.images_allocated / len(samples), 2),
+        }
+
+# Function to write synthetic photo-like JPEG backgrounds: colored noise over a gradient
+def make_backgrounds(dir_path, count, size, seed=0):
+    paths = []
+    for i in range(count):
+        channels = [Image.effect_noise(size, 30 + 10 * ((seed + i + c) % 5)) for c in range(3)]
+        gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+        im = Image.blend(Image.merge("RGB", channels), gradient, 0.5)
+        path = os.path.join(dir_path, f"bg_{size[0]}x{size[1]}_{i}.jpg")
+        im.save(path, quality=90)
+        paths.append(path)
+    return paths
+
+# Function to make quotes of varying length, the same for a given seed
+def make_quotes(count, seed=0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 30))) + " - Someone" for _ in range(count)]
+
+# Function to time every stage of build_image on its own, for posts synthetic posts
+def bench_stages(im_paths, quotes, posts, fmt, size=backgrounds.DEFAULT_SIZE):
+    timers = {name: StageTimer(name) for name in STAGES}
+    quote_font = get_font(FONT_PATH, 115)
+    trademark_font = get_font(FONT_PATH, 52)
+    logo_w, logo_h = get_logo_size(LOGO_PATH)
+    width = int(size[0] * LOGO_WIDTH)
+    logo, mask = get_logo(LOGO_PATH, (width, int(logo_h * width / logo_w)))
+    for i in range(posts):
+        im_path, quote = im_paths[i % len(im_paths)], quotes[i % len(quotes)]
+        decoded, box = timers["decode"].run(backgrounds.decode_background, im_path, size)
+        im = timers["resize"].run(backgrounds.fit_background, decoded, box, size)
+        im = timers["tint"].run(tint.apply_tint, im)
+        im = timers["place_quote"].run(place_quote, im, quote, quote_font)
+        im = timers["trademark"].run(place_trademark, im, TRADEMARK, trademark_font)
+        im = timers["logo"].run(place_logo, im, logo, TRADEMARK, trademark_font, mask)
+        timers["save"].run(fmt.encode, im)
+    return {name: timer.report() for name, timer in timers.items()}
+
+# Function to render and encode one post of the end-to-end run, without the disk cache
+def _render(im_path, quote, template_path, fmt):
+    return len(fmt.encode(templates.render_post(im_path, quote, load_template(template_path), (), None)))
+
+# Function to time the whole render path through the process pool
+def bench_pipeline(im_paths, quotes, posts, fmt, workers, template_path=DEFAULT_TEMPLATE):
+    template_path = os.path.abspath(template_path)
+    jobs = [(im_paths[i % len(im_paths)], quotes[i % len(quotes)], template_path, fmt) for i in range(posts)]
+    start = time.perf_counter()
+    failed = sum(1 for result in render_jobs(_render, jobs, workers) if result.error)
+    elapsed = time.perf_counter() - start
+    return {"workers": workers, "posts": posts, "failed": failed, "seconds": round(elapsed, 3),
+            "posts_per_sec": round(posts / elapsed, 2)}
+
+# Function to run the benchmark for each background size and return the report
+def run_bench(sizes=DEFAULT_SIZES, images=4, quotes=16, posts=32, workers=(1,), fmt=None, seed=0):
+    fmt = fmt or OutputFormat()
+    quote_list = make_quotes(quotes, seed)
+    report = {
+        "version": REPORT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {"sizes": [list(size) for size in sizes], "images": images, "quotes": quotes, "posts": posts,
+                   "workers": list(workers), "output": fmt.params(), "seed": seed},
+        "cases": [],
+    }
+    with tempfile.TemporaryDirectory(prefix="bulkpost-bench-") as tmp:
+        for size in sizes:
+            print(f"Benchmarking {size[0]}x{size[1]} backgrounds...")
+            im_paths = make_backgrounds(tmp, images, size, seed)
+            backgrounds.clear_cache()
+            case = {"source_size": list(size), "stages": bench_stages(im_paths, quote_list, posts, fmt)}
+            case["stage_posts_per_sec"] = round(1000 / sum(stage["mean_ms"] for stage in case["stages"].values()), 2)
+            case["pipeline"] = []
+            for n in workers:
+                backgrounds.clear_cache()
+                case["pipeline"].append(bench_pipeline(im_paths, quote_list, posts, fmt, resolve_workers(n)))
+            report["cases"].append(case)
+    peak = peak_rss()
+    report["peak_rss_mb"] = round(peak / 2**20, 1) if peak else None
+    return report
+
+# Function to find stages and pipeline runs that got slower than a baseline report by more than tolerance
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    regressions = []
+    old_cases = {tuple(case["source_size"]): case for case in baseline.get("cases", [])}
+    for case in report["cases"]:
+        old = old_cases.get(tuple(case["source_size"]))
+        if old is None:
+            continue
+        label = "x".join(str(n) for n in case["source_size"])
+        for name, stage in case["stages"].items():
+            before = old["stages"].get(name, {}).get("p50_ms")
+            if before and stage["p50_ms"] > before * (1 + tolerance):
+                regressions.append(f"{label} {name}: p50 {before} -> {stage['p50_ms']} ms")
+        old_runs = {run["workers"]: run for run in old.get("pipeline", [])}
+        for run in case["pipeline"]:
+            before = old_runs.get(run["workers"], {}).get("posts_per_sec")
+            if before and run["posts_per_sec"] < before / (1 + tolerance):
+                regressions.append(f"{label} {run['workers']} workers: {before} -> {run['posts_per_sec']} posts/s")
+    return regressions
+
+# Function to format a report as a table
+def format_report(report):
+    lines = []
+    for case in report["cases"]:
+        lines.append(f"{case['source_size'][0]}x{case['source_size'][1]} backgrounds")
+        lines.append(f"  {'stage':<12} {'p50 ms':>9} {'p95 ms':>9} {'images/op':>10} {'peak RSS MB':>12}")
+        for name, stage in case["stages"].items():
+            lines.append(f"  {name:<12} {stage['p50_ms']:>9.2f} {stage['p95_ms']:>9.2f} "
+                         f"{stage['images_allocated_per_op']:>10} {stage['peak_rss_mb'] or '-':>12}")
+        for run in case["pipeline"]:
+            lines.append(f"  full render, {run['workers']} workers: {run['posts_per_sec']} posts/s")
+    lines.append(f"Peak RSS: {report['peak_rss_mb']} MB")
+    return "\n".join(lines)
+
+# Function to write a report as JSON
+def save_report(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
@@ -0,0 +1,199 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+from bulkpost import backgrounds, bench, discovery, metrics, shards
+from bulkpost.encoders import add_format_arguments, format_from_args
+from bulkpost.jobs import load_job, run_job
+
+# Exit codes: 0 every post built, 1 some posts failed or are missing, 2 the job itself could not run
+EXIT_FAILED_POSTS = 1
+EXIT_BAD_JOB = 2
+
+# Function to apply action to each job file headless and print the JSON summaries.
+# Progress goes to stderr so stdout carries only the JSON.
+def for_each_job(args, action):
+    summaries = []
+    with contextlib.ExitStack() as stack:
+        log = stack.enter_context(open(os.devnull, 'w')) if args.quiet else sys.stderr
+        for path in args.jobs:
+            try:
+                job = load_job(path)
+                if getattr(args, "memory_budget", None):
+                    job.memory["budget_mb"] = args.memory_budget
+                if getattr(args, "no_disk_cache", False):
+                    job.disk_cache["enabled"] = False
+                if getattr(args, "disk_cache_mb", None):
+                    job.disk_cache["max_mb"] = args.disk_cache_mb
+                with contextlib.redirect_stdout(log):
+                    summaries.append(action(job))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"Error running job {path}: {type(e).__name__}: {e}", file=sys.stderr)
+                summaries.append({"job": path, "error": f"{type(e).__name__}: {e}"})
+    print(json.dumps(summaries[0] if len(summaries) == 1 else summaries, indent=1 if args.pretty else None))
+    if any("error" in summary for summary in summaries):
+        return EXIT_BAD_JOB
+    if any(summary.get("failed") or summary.get("missing") for summary in summaries):
+        return EXIT_FAILED_POSTS
+    return 0
+
+def run_command(args):
+    if args.shard:
+        index, count = args.shard
+        return for_each_job(args, lambda job: shards.run_shard(job, index, count, args.workers, args.force))
+    return for_each_job(args, lambda job: run_job(job, args.workers, args.force))
+
+def plan_command(args):
+    def plan(job):
+        plan = shards.build_plan(job)
+        return {"job": job.name, "plan": shards.save_plan(job, plan), "posts": len(plan["posts"])}
+    return for_each_job(args, plan)
+
+def merge_command(args):
+    return for_each_job(args, shards.merge_shards)
+
+def queue_command(args):
+    return for_each_job(args, lambda job: shards.fill_queue(job, args.chunk_size))
+
+def work_command(args):
+    return for_each_job(args, lambda job: shards.run_worker(job, args.name, args.workers, args.force,
+                                                            args.requeue_after))
+
+# Function to parse a comma-separated list of WxH sizes
+def sizes_argument(text):
+    try:
+        return [tuple(int(n) for n in size.lower().split("x")) for size in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"sizes must look like 1080x1080,4000x3000, got {text!r}")
+
+# Function to benchmark the render path and write the JSON report
+def bench_command(args):
+    report = bench.run_bench(args.sizes, args.images, args.quotes, args.posts,
+                             [int(n) for n in args.workers.split(",")], format_from_args(args), args.seed)
+    bench.save_report(report, args.output)
+    print(bench.format_report(report))
+    print(f"Report written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = bench.compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return EXIT_FAILED_POSTS
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+# Function to check job files without rendering anything
+def validate_command(args):
+    status = 0
+    for path in args.jobs:
+        try:
+            load_job(path)
+            print(f"{path}: ok")
+        except (OSError, ValueError) as e:
+            print(f"{path}: {e}")
+            status = EXIT_BAD_JOB
+    return status
+
+# Function to scan background directories up front: counts, formats and unreadable files.
+# Refreshes the image index, so the next run starts without opening any unchanged file.
+def scan_command(args):
+    reports = []
+    for dir_path in args.dirs:
+        result = discovery.scan_images(dir_path, not args.flat)
+        formats = {}
+        for info in result.images:
+            formats[info.format] = formats.get(info.format, 0) + 1
+        reports.append({"dir": dir_path, "images": len(result.images), "formats": formats, "checked": result.checked,
+                        "corrupt": [{"path": path, "error": error} for path, error in result.corrupt],
+                        "seconds": round(result.seconds, 3)})
+    print(json.dumps(reports[0] if len(reports) == 1 else reports, indent=1 if args.pretty else None))
+    return EXIT_FAILED_POSTS if any(report["corrupt"] for report in reports) else 0
+
+# Function to parse --shard for argparse
+def shard_argument(text):
+    try:
+        return shards.parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+# Function to add the arguments shared by the commands that take job files
+def add_job_arguments(parser, render=False):
+    parser.add_argument("jobs", nargs="+", metavar="JOB", help="job file")
+    if render:
+        parser.add_argument("--workers", type=int, default=None,
+                            help="render processes, overriding the job file (0 = one per core)")
+        parser.add_argument("--force", action="store_true", help="render every post even if it is up to date")
+        parser.add_argument("--memory-budget", type=float, metavar="MB",
+                            help="peak memory for the whole run; sets workers, background cache and in-flight posts")
+        backgrounds.add_disk_cache_arguments(parser)
+        metrics.add_metrics_arguments(parser, progress=True)
+    parser.add_argument("--quiet", action="store_true", help="print only the JSON summary")
+    parser.add_argument("--pretty", action="store_true", help="indent the JSON summary")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bulkpost", description="Render quote posts in bulk from job files")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run job files (JSON, or YAML with PyYAML installed)")
+    add_job_arguments(run, render=True)
+    run.add_argument("--shard", type=shard_argument, metavar="I/N",
+                     help="render only shard I of N (1-based) into OUTPUT/shard-I-of-N, following the job's plan")
+    run.set_defaults(func=run_command)
+
+    plan = commands.add_parser("plan", help="fetch quotes once and write the list of posts every shard follows")
+    add_job_arguments(plan)
+    plan.set_defaults(func=plan_command)
+
+    merge = commands.add_parser("merge", help="move shard outputs into the output directory and check none is missing")
+    add_job_arguments(merge)
+    merge.set_defaults(func=merge_command)
+
+    queue = commands.add_parser("queue", help="split the job's plan into a work queue on the filesystem")
+    add_job_arguments(queue)
+    queue.add_argument("--chunk-size", type=int, default=shards.DEFAULT_CHUNK_SIZE, help="posts per work item")
+    queue.set_defaults(func=queue_command)
+
+    work = commands.add_parser("work", help="render work items from the job's queue until it is empty")
+    add_job_arguments(work, render=True)
+    work.add_argument("--name", help="worker name, used for its output directory (default: host-pid)")
+    work.add_argument("--requeue-after", type=float, default=shards.DEFAULT_REQUEUE_AFTER, metavar="SECONDS",
+                      help="put work items claimed longer than this back in the queue")
+    work.set_defaults(func=work_command)
+
+    bench_parser = commands.add_parser("bench", help="time each stage of the render path on synthetic posts")
+    bench_parser.add_argument("--sizes", type=sizes_argument, default=list(bench.DEFAULT_SIZES),
+                              help="background sizes to generate (default 1080x1080,1920x1080,4000x3000)")
+    bench_parser.add_argument("--images", type=int, default=4, help="backgrounds per size")
+    bench_parser.add_argument("--quotes", type=int, default=16, help="synthetic quotes")
+    bench_parser.add_argument("--posts", type=int, default=32, help="posts rendered per size")
+    bench_parser.add_argument("--workers", default="1", help="comma-separated worker counts for the full render")
+    bench_parser.add_argument("--seed", type=int, default=0)
+    bench_parser.add_argument("--output", default="bench.json", help="where to write the JSON report")
+    bench_parser.add_argument("--baseline", help="earlier report to compare against; regressions exit with 1")
+    bench_parser.add_argument("--tolerance", type=float, default=bench.DEFAULT_TOLERANCE,
+                              help="allowed slowdown against the baseline (0.15 = 15%%)")
+    add_format_arguments(bench_parser)
+    bench_parser.set_defaults(func=bench_command)
+
+    scan = commands.add_parser("scan", help="check background directories and report unreadable images")
+    scan.add_argument("dirs", nargs="+", metavar="DIR", help="directory of backgrounds")
+    scan.add_argument("--flat", action="store_true", help="do not look into subdirectories")
+    scan.add_argument("--pretty", action="store_true", help="indent the JSON report")
+    scan.set_defaults(func=scan_command)
+
+    validate = commands.add_parser("validate", help="check job files without rendering")
+    validate.add_argument("jobs", nargs="+", metavar="JOB", help="job file")
+    validate.set_defaults(func=validate_command)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if hasattr(args, "metrics_log"):
+        metrics.metrics_from_args(args)
+    try:
+        return args.func(args)
+    finally:
+        metrics.reset()
@@ -0,0 +1,201 @@
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp')
+INDEX_PATH = os.path.join(".cache", "images.json")
+INDEX_VERSION = 4
+SCAN_THREADS = 16  # Directory listings and header reads mostly wait on the disk
+TAIL_BYTES = 65536  # JPEG end markers are looked for backwards from the end of a file, this much at a time
+
+# A usable background found by a scan; format is what the file really is, whatever its extension
+ImageInfo = namedtuple("ImageInfo", ["path", "width", "height", "format"])
+
+# Outcome of a scan: usable images in path order, and (path, error) for files that cannot be read
+ScanResult = namedtuple("ScanResult", ["images", "corrupt", "checked", "seconds"])
+
+# Function to list the candidate image files and the subdirectories of one directory
+def _list_dir(dir_path, recursive):
+    files, subdirs = [], []
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        subdirs.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                    st = entry.stat()
+                    files.append((entry.path, st.st_mtime_ns, st.st_size))
+    except OSError as e:
+        print(f"Error listing {dir_path}: {e}")
+    return files, subdirs
+
+# Function to walk a directory tree, listing several directories at a time on pool's threads
+def walk_images(dir_path, pool, recursive=True):
+    files = []
+    pending = [pool.submit(_list_dir, dir_path, recursive)]
+    while pending:
+        found, subdirs = pending.pop().result()
+        files.extend(found)
+        pending.extend(pool.submit(_list_dir, subdir, recursive) for subdir in subdirs)
+    return sorted(files)
+
+# Function to read an image's size and real format from its header, closing the file again.
+# Returns (width, height, format), or raises when the file is not an image Pillow can read.
+def read_header(path):
+    with Image.open(path) as im:
+        return im.size[0], im.size[1], im.format
+
+# Function to find where a JPEG's compressed data starts: the end of its first SOS header.
+# Marker segments before it are skipped by their lengths, so APPn payloads such as an EXIF
+# thumbnail (a whole JPEG with its own EOI marker) are never mistaken for the image's end.
+def _jpeg_scan_start(f):
+    f.seek(0)
+    if f.read(2) != b"\xff\xd8":
+        raise ValueError("not a JPEG file (no SOI marker)")
+    while True:
+        prefix = f.read(1)
+        if not prefix:
+            raise ValueError("truncated JPEG file (ends before its image data)")
+        if prefix != b"\xff":
+            raise ValueError(f"corrupt JPEG file (no marker at byte {f.tell() - 1})")
+        marker = f.read(1)
+        while marker == b"\xff":  # Fill bytes before a marker
+            marker = f.read(1)
+        if not marker:
+            raise ValueError("truncated JPEG file (ends before its image data)")
+        if 0xD0 <= marker[0] <= 0xD7 or marker[0] == 0x01:  # Markers without a segment
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            raise ValueError("truncated JPEG file (ends before its image data)")
+        segment_end = f.tell() + int.from_bytes(length, 'big') - 2
+        if marker == b"\xda":
+            return segment_end
+        f.seek(segment_end)
+
+# Function to check that a JPEG has an EOI marker after its image data starts.
+# Compressed data never contains FF D9 (an FF byte in it is always followed by 00), so the
+# last EOI past the first SOS is the image's own. It is searched for backwards from the end,
+# so trailing data after it (motion photo videos, maker notes) can be any length.
+def _check_jpeg_end(f):
+    scan_start = _jpeg_scan_start(f)
+    end = f.seek(0, os.SEEK_END)
+    overlap = b""  # A marker split across two chunks is still found
+    while end > scan_start:
+        start = max(scan_start, end - TAIL_BYTES)
+        f.seek(start)
+        chunk = f.read(end - start) + overlap
+        if b"\xff\xd9" in chunk:
+            return
+        overlap = chunk[:1]
+        end = start
+    raise ValueError("truncated JPEG file (no end marker after its image data)")
+
+# Function to check that a PNG's chunks run all the way to IEND, following their lengths
+# rather than searching for the name, which compressed image data can contain by chance
+def _check_png_end(f):
+    size = f.seek(0, os.SEEK_END)
+    pos = 8  # After the signature
+    while pos + 12 <= size:  # Length, type and CRC of the next chunk fit
+        f.seek(pos)
+        header = f.read(8)
+        if header[4:] == b"IEND":
+            return
+        pos += 12 + int.from_bytes(header[:4], 'big')
+    raise ValueError("truncated PNG file (no IEND chunk)")
+
+END_CHECKS = {"JPEG": _check_jpeg_end, "PNG": _check_png_end}
+
+# Function to check that a file reaches the end its format says it should (JPEG EOI, PNG IEND),
+# so files cut short by a failed copy or download are caught without decoding them
+def check_end(path, format):
+    check = END_CHECKS.get(format)
+    if check is None:
+        return
+    with open(path, 'rb') as f:
+        check(f)
+
+# Function to check one file, returning ("ok", width, height, format) or ("corrupt", error)
+def _check(path):
+    try:
+        header = read_header(path)
+        check_end(path, header[2])
+        return ("ok",) + header
+    except Exception as e:  # Any failure here would otherwise surface mid-batch
+        return ("corrupt", f"{type(e).__name__}: {e}")
+
+# Function to load the image index: {path: [mtime_ns, size, status, ...]}.
+# Other per-image caches share the format under their own path and version.
+def load_index(path=INDEX_PATH, version=INDEX_VERSION):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable image index {path}: {e}")
+        return {}
+    return index.get("images", {}) if index.get("version") == version else {}
+
+# Function to write the image index atomically
+def save_index(entries, path=INDEX_PATH, version=INDEX_VERSION):
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": version, "images": entries}, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Error writing image index: {e}")
+
+# Function to find every readable background under a directory.
+# Files are validated from their headers and end markers, and the result is kept in an index keyed by
+# path, mtime and size, so a later scan only opens new or changed files.
+def scan_images(dir_path, recursive=True, index_path=INDEX_PATH):
+    started = time.perf_counter()
+    root = os.path.abspath(dir_path)
+    with ThreadPoolExecutor(SCAN_THREADS) as pool:
+        files = walk_images(dir_path, pool, recursive)
+        index = load_index(index_path) if index_path else {}
+        entries = {}
+        todo = []
+        for path, mtime_ns, size in files:
+            entry = index.get(os.path.abspath(path))
+            if entry is not None and entry[0] == mtime_ns and entry[1] == size:
+                entries[path] = entry
+            else:
+                todo.append((path, mtime_ns, size))
+        for (path, mtime_ns, size), result in zip(todo, pool.map(_check, [path for path, _, _ in todo])):
+            entries[path] = [mtime_ns, size] + list(result)
+
+    images, corrupt = [], []
+    for path, _, _ in files:
+        entry = entries[path]
+        if entry[2] == "ok":
+            images.append(ImageInfo(path, entry[3], entry[4], entry[5]))
+        else:
+            corrupt.append((path, entry[3]))
+
+    if index_path:
+        # Entries under other directories are kept; those under this one are replaced by the scan
+        merged = {path: entry for path, entry in index.items() if not path.startswith(root + os.sep)}
+        if todo or len(merged) + len(entries) != len(index):  # New, changed or deleted files
+            merged.update((os.path.abspath(path), entry) for path, entry in entries.items())
+            save_index(merged, index_path)
+    return ScanResult(images, corrupt, len(todo), time.perf_counter() - started)
+
+# Function to list the usable backgrounds of a directory, reporting unreadable files up front
+def find_images(dir_path, recursive=True, index_path=INDEX_PATH):
+    result = scan_images(dir_path, recursive, index_path)
+    if result.corrupt:
+        print(f"Skipping {len(result.corrupt)} unreadable image(s) in {dir_path}:")
+        for path, error in result.corrupt:
+            print(f"  {path}: {error}")
+    return [info.path for info in result.images]
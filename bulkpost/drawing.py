@@ -0,0 +1,48 @@
+from PIL import Image, ImageDraw
+
+from bulkpost import layout
+from bulkpost.assets import text_size
+
+# Drawing helpers for composing a post by hand, one element per call. The scripts draw posts
+# from templates (see templates.py); only bench.py still uses these, so it can time each
+# element on its own.
+
+LOGO_WIDTH = 0.2  # Share of the background width
+BOTTOM_MARGIN = 10  # Pixels between the trademark and the bottom edge, and between logo and trademark
+
+# Function to place the quote in the center of the image
+def place_quote(im, quote, font):
+    # Wrapped by pixel width and shrunk from font.size until the quote fits
+    layout.place_quote(im, quote, font.path, max_size=font.size)
+    return im
+
+# Function to place a trademark text at the bottom of the image
+def place_trademark(im, trademark, font):
+    draw = ImageDraw.Draw(im)
+    W, H = im.size
+    text_width, text_height = text_size(trademark, font)
+    x = (W - text_width) / 2
+    y = H - text_height - BOTTOM_MARGIN
+    draw.text((x, y), trademark, font=font, fill="white")
+    return im
+
+# Function to place a logo at the bottom-center of the image, just above the trademark
+def place_logo(bkg, logo, trademark, font, mask=None):
+    bkg_width, bkg_height = bkg.size
+    text_width, text_height = text_size(trademark, font)
+
+    # Resize the logo to 20% of the background width, unless it is already pre-sized
+    logo_size = int(bkg_width * LOGO_WIDTH)
+    if logo.size[0] != logo_size:
+        logo = logo.resize((logo_size, int(logo.size[1] * logo_size / logo.size[0])), Image.Resampling.LANCZOS)
+    logo_width, logo_height = logo.size
+
+    x_position = (bkg_width - logo_width) // 2
+    y_position = bkg_height - logo_height - text_height - BOTTOM_MARGIN
+
+    # Use the logo's alpha channel for transparency, unless a cached mask was passed in
+    if mask is None:
+        logo = logo.convert("RGBA")
+        mask = logo
+    bkg.paste(logo, (x_position, y_position), mask)
+    return bkg
@@ -0,0 +1,122 @@
+import io
+import os
+import queue
+import threading
+
+from bulkpost import metrics
+
+FORMATS = ("png", "jpeg", "webp")
+EXTENSIONS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+DEFAULT_QUALITY = 90
+DEFAULT_COMPRESS_LEVEL = 6  # Pillow's own PNG default
+DEFAULT_WEBP_METHOD = 4
+
+# How a rendered post is encoded: format plus the knobs that trade speed for size
+class OutputFormat:
+    def __init__(self, format="png", quality=DEFAULT_QUALITY, compress_level=DEFAULT_COMPRESS_LEVEL,
+                 lossless=False, method=DEFAULT_WEBP_METHOD):
+        format = format.lower()
+        if format == "jpg":
+            format = "jpeg"
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported output format '{format}', expected one of {', '.join(FORMATS)}")
+        self.format = format
+        self.quality = quality
+        self.compress_level = compress_level
+        self.lossless = lossless
+        self.method = method
+
+    @property
+    def ext(self):
+        return EXTENSIONS[self.format]
+
+    # Function to get the Pillow save() options for this format
+    def save_options(self):
+        if self.format == "png":
+            return {"format": "PNG", "compress_level": self.compress_level}
+        if self.format == "jpeg":
+            return {"format": "JPEG", "quality": self.quality, "optimize": True, "progressive": True}
+        if self.lossless:
+            return {"format": "WEBP", "lossless": True, "quality": self.quality, "method": self.method}
+        return {"format": "WEBP", "quality": self.quality, "method": self.method}
+
+    # Function to describe the format for manifests and reports
+    def params(self):
+        options = self.save_options()
+        options.pop("format")
+        return {"format": self.format, **options}
+
+    def __repr__(self):
+        return f"OutputFormat({', '.join(f'{k}={v!r}' for k, v in self.params().items())})"
+
+    # Function to encode an image to bytes in this format
+    def encode(self, im):
+        if im.mode not in ("RGB", "L") and self.format == "jpeg":
+            im = im.convert("RGB")
+        buffer = io.BytesIO()
+        with metrics.timed("bulkpost_encode_seconds", format=self.format):
+            im.save(buffer, **self.save_options())
+        return buffer.getvalue()
+
+# Function to add the output format options to an argparse parser
+def add_format_arguments(parser):
+    parser.add_argument("--format", default="png", choices=FORMATS + ("jpg",), help="output image format")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY, help="JPEG/WebP quality (1-100)")
+    parser.add_argument("--compress-level", type=int, default=DEFAULT_COMPRESS_LEVEL,
+                        help="PNG zlib level, 0 (fastest, largest) to 9 (slowest, smallest)")
+    parser.add_argument("--lossless", action="store_true", help="lossless WebP")
+    parser.add_argument("--webp-method", type=int, default=DEFAULT_WEBP_METHOD,
+                        help="WebP effort, 0 (fastest) to 6 (smallest)")
+
+# Function to build an OutputFormat from parsed arguments
+def format_from_args(args):
+    return OutputFormat(args.format, args.quality, args.compress_level, args.lossless, args.webp_method)
+
+# Function to write bytes to a file atomically
+def write_file(path, data):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+# Thread that writes encoded posts to disk so rendering doesn't wait on the filesystem
+class BackgroundWriter:
+    def __init__(self, max_pending=32):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.errors = []
+        self.written = 0
+        self.bytes_written = 0
+        self.thread = threading.Thread(target=self._run, name="writer", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            path, data = item
+            try:
+                write_file(path, data)
+                self.written += 1
+                self.bytes_written += len(data)
+            except OSError as e:
+                self.errors.append((path, str(e)))
+                print(f"Error writing {path}: {e}")
+
+    # Function to queue bytes for writing; blocks only when max_pending writes are waiting
+    def write(self, path, data):
+        self.queue.put((path, data))
+
+    # Function to wait for every queued write to finish
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
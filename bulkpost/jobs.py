@@ -0,0 +1,360 @@
+import contextlib
+import json
+import os
+import random
+import time
+
+from bulkpost import memory, metrics, pairing, quote_reader, templates, variants
+from bulkpost.backgrounds import CACHE_DIR, DISK_CACHE_MB, prune_disk_cache
+from bulkpost.discovery import find_images
+from bulkpost.encoders import OutputFormat, BackgroundWriter
+from bulkpost.manifest import BuildManifest, post_digest
+from bulkpost.quote_sources import ApiNinjasSource, ForismaticSource, fetch_quotes
+from bulkpost.quote_store import QuoteStore
+from bulkpost.render_engine import RenderPool, render_jobs, resolve_workers
+from bulkpost.templates import DEFAULT_TEMPLATE, load_template
+
+# Bump RENDER_VERSION when the drawing code changes so incremental builds re-render everything
+RENDER_VERSION = 5
+
+SOURCES = ("file", "forismatic", "api_ninjas")
+PAIRINGS = ("all", "one_to_one", "random", "spread")
+SAVE_EVERY = 100  # Manifest checkpoint interval, in rendered posts
+FILE_OPTIONS = ("format", "text_column", "author_column", "tags_column", "authors", "tags", "dedupe")
+
+# A batch job read from a JSON or YAML file. Paths are relative to the working directory.
+#
+#   source:    {"type": "file", "path": "in/quotes.txt"}
+#              {"type": "file", "path": "corpus.csv", "authors": ["Seneca"], "tags": ["stoic"]}  (also .jsonl)
+#              {"type": "forismatic", "count": 10}
+#              {"type": "api_ninjas", "author": "Aristotle", "count": 10, "api_key_env": "API_NINJAS_KEY"}
+#   images:    directory of backgrounds, searched recursively unless "recursive" is false
+#   pairing:   "all" (every image with every quote), "one_to_one" (in order), "random",
+#              or "spread" (each background once, shuffled, before any is reused)
+#   curate:    {"dedupe": true, "min_contrast": 3.0} drops near-duplicate backgrounds and ones the
+#              quote would be hard to read on after tinting (false or 0 keeps them)
+#   template, logo, trademark, max_words, workers, incremental, prune, offline, seed
+#   output:    {"dir": "out", "format": "png", "quality": 90, "compress_level": 6, "lossless": false}
+#   memory:    {"budget_mb": 2048, "in_flight": 8}
+#   disk_cache: {"enabled": true, "max_mb": 2048} keeps prepared backgrounds in .cache/backgrounds
+#              between runs, deleting the least recently used beyond max_mb (false turns it off)
+#   variants:  ["square", "story", "twitter", {"name": "banner", "size": [1500, 500]}]
+#              renders every post at each size into out/<name>/ instead of once at the template size
+class Job:
+    def __init__(self, config, path=None):
+        self.path = path
+        self.name = config.get("name", os.path.splitext(os.path.basename(path or "job"))[0])
+        self.source = dict(config.get("source", {}))
+        self.images = config.get("images", os.path.join("in", "raw"))
+        self.recursive = config.get("recursive", True)
+        self.pairing = config.get("pairing", "one_to_one")
+        self.curate = dict(config.get("curate", {}))
+        self.template = config.get("template", DEFAULT_TEMPLATE)
+        self.logo = config.get("logo", True)
+        self.trademark = config.get("trademark", True)
+        self.max_words = config.get("max_words")
+        self.workers = config.get("workers", 1)
+        self.incremental = config.get("incremental", True)
+        self.prune = config.get("prune", False)
+        self.offline = config.get("offline")
+        self.seed = config.get("seed")
+        self.output = dict(config.get("output", {}))
+        self.output.setdefault("dir", "out")
+        self.memory = dict(config.get("memory", {}))
+        disk_cache = config.get("disk_cache", {})
+        self.disk_cache = dict(disk_cache) if isinstance(disk_cache, dict) else {"enabled": bool(disk_cache)}
+        self.variants = variants.parse_variants(config.get("variants"))
+        self.config = config
+        self.validate()
+
+    # Function to reject a job before any quote is fetched or image decoded
+    def validate(self):
+        source_type = self.source.get("type")
+        if source_type not in SOURCES:
+            raise ValueError(f"source.type must be one of {', '.join(SOURCES)}, got {source_type!r}")
+        if source_type == "file" and not self.source.get("path"):
+            raise ValueError("source.path is required for a file source")
+        if source_type == "file" and self.source.get("format", "txt") not in quote_reader.FORMATS:
+            raise ValueError(f"source.format must be one of {', '.join(quote_reader.FORMATS)}")
+        if source_type == "api_ninjas" and not self.source.get("author"):
+            raise ValueError("source.author is required for an api_ninjas source")
+        if source_type != "file" and int(self.source.get("count", 0)) <= 0:
+            raise ValueError(f"source.count must be a positive number for a {source_type} source")
+        if self.pairing not in PAIRINGS:
+            raise ValueError(f"pairing must be one of {', '.join(PAIRINGS)}, got {self.pairing!r}")
+        if not os.path.isdir(self.images):
+            raise ValueError(f"images directory {self.images} does not exist")
+        if not os.path.exists(self.template):
+            raise ValueError(f"template {self.template} does not exist")
+        self.format()  # Raises on an unknown output format
+        try:
+            # A template missing a field or with a field of the wrong type fails here, not mid-batch
+            template = templates.load_template(self.template)
+            templates.background_options(template)
+            templates.get_overlay(template, template.size, self.disabled)
+        except (AttributeError, KeyError, TypeError) as e:
+            raise ValueError(f"template {self.template} is invalid: {type(e).__name__}: {e}")
+
+    # Function to get the output encoder described by the job
+    def format(self):
+        options = {key: self.output[key] for key in ("quality", "compress_level", "lossless") if key in self.output}
+        if "webp_method" in self.output:
+            options["method"] = self.output["webp_method"]
+        return OutputFormat(self.output.get("format", "png"), **options)
+
+    @property
+    def disabled(self):
+        return templates.disabled_roles(self.logo, self.trademark)
+
+    # Directory of the on-disk background cache, or None when it is turned off
+    @property
+    def cache_dir(self):
+        return CACHE_DIR if self.disk_cache.get("enabled", True) else None
+
+# Function to load a job file; YAML needs PyYAML, JSON works out of the box.
+# A file that does not parse raises ValueError naming it, like any other bad job.
+def load_job(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        if os.path.splitext(path)[1].lower() in ('.yml', '.yaml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("PyYAML is needed for YAML job files (pip install pyyaml), or use JSON")
+            try:
+                config = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ValueError(f"{path}: invalid YAML: {e}")
+        else:
+            try:
+                config = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}: invalid JSON: {e}")
+    if not isinstance(config, dict):
+        raise ValueError(f"{path} must contain a mapping of job settings")
+    return Job(config, path)
+
+# Function to stream the quotes of a job from its source.
+# Quote files are read lazily; API quotes are fetched up front since they are few.
+def load_quotes(job, store=None):
+    source_type = job.source["type"]
+    if source_type == "file":
+        options = {key: job.source[key] for key in FILE_OPTIONS if key in job.source}
+        quotes = quote_reader.iter_quotes(job.source["path"], **options)
+    else:
+        if source_type == "forismatic":
+            source = ForismaticSource()
+        else:
+            api_key = job.source.get("api_key") or os.environ.get(job.source.get("api_key_env", "API_NINJAS_KEY"), "")
+            source = ApiNinjasSource(job.source["author"], api_key)
+        quotes = fetch_quotes(source, int(job.source["count"]), store=store, offline=job.offline)
+    if job.max_words:
+        quotes = (' '.join(quote.split()[:job.max_words]) for quote in quotes)
+    return quotes
+
+# Function to pair backgrounds with quotes according to the job's pairing strategy.
+# Quotes are consumed one at a time (a chunk at a time for "all"), so a quote file is never held in memory.
+def pair(job, im_paths, quotes):
+    if job.pairing == "all":
+        yield from pairing.all_combinations(im_paths, quotes)
+    elif job.pairing == "one_to_one":
+        yield from zip(im_paths, quotes)
+    elif job.pairing == "spread":
+        for quote, im_path in zip(quotes, pairing.spread(im_paths, job.seed)):
+            yield im_path, quote
+    else:
+        rng = random.Random(job.seed)
+        for quote in quotes:
+            yield rng.choice(im_paths), quote
+
+# Function to render and encode one post in a worker; writing happens back in the main process.
+# Returns the encoded outputs, one per variant (a single None variant is the template size).
+def encode_post(im_path, quote, template_path, disabled, fmt, digest, todo=(None,), cache_dir=CACHE_DIR):
+    template = load_template(template_path)
+    if todo != (None,):
+        return variants.render_variants(im_path, quote, template, todo, fmt, disabled, cache_dir)
+    frame = memory.get_frame(template.size)  # Drawn into and encoded before the next post reuses it
+    return [fmt.encode(templates.render_post(im_path, quote, template, disabled, cache_dir, frame))]
+
+# Function to list the outputs of a post as (variant, digest): one per variant of the job,
+# or the post itself at the template size
+def post_outputs(job, digest):
+    if not job.variants:
+        return [(None, digest)]
+    return [(variant, variants.variant_digest(digest, variant)) for variant in job.variants]
+
+# Function to get the render settings that go into every post digest of a job
+def render_params(job):
+    template = load_template(job.template)
+    return {"version": RENDER_VERSION, "template": template.digest(), "disabled": sorted(job.disabled),
+            "output": job.format().params()}
+
+# Function to collect the images and quotes of a job.
+# With a summary, counts the backgrounds curation left out.
+def load_inputs(job, summary=None):
+    im_paths = find_images(job.images, job.recursive)
+    if not im_paths:
+        raise ValueError(f"No image files found in {job.images}")
+    found = len(im_paths)
+    im_paths, report = pairing.curate(im_paths, load_template(job.template), job.curate.get("dedupe", True),
+                                      job.curate.get("min_contrast", pairing.MIN_CONTRAST))
+    if not im_paths:
+        raise ValueError(f"None of the {found} images in {job.images} is usable; see curate in the job file")
+    if summary is not None:
+        summary.update(images=len(im_paths), near_duplicates=len(report["near_duplicates"]),
+                       unreadable=len(report["unreadable"]))
+    store = QuoteStore() if job.source["type"] != "file" else None
+    try:
+        quotes = load_quotes(job, store)
+    finally:
+        if store is not None:
+            store.close()
+    return im_paths, quotes
+
+# Function to list a job's posts as (digest, image, quote) in pairing order.
+# With a summary, counts the quotes as they are consumed.
+def iter_posts(job, im_paths, quotes, summary=None):
+    font_path = load_template(job.template).quote["font"]
+    params = render_params(job)
+
+    def counted():
+        for quote in quotes:
+            summary["quotes"] += 1
+            yield quote
+
+    for im_path, quote in pair(job, im_paths, counted() if summary is not None else quotes):
+        yield post_digest(im_path, quote, font_path, None, params), im_path, quote
+
+# Function to start the summary of a run
+def new_summary(job, out_dir, **fields):
+    return dict({"job": job.name, "output_dir": out_dir, "rendered": 0, "skipped": 0, "failed": 0,
+                 "failures": []}, **fields)
+
+# Function to fit a job's workers, background caches and posts in flight into its memory budget
+def memory_plan(job, workers):
+    size = max([variant.size for variant in job.variants] or [load_template(job.template).size],
+               key=lambda size: size[0] * size[1])
+    return memory.plan_memory(job.memory.get("budget_mb"), workers, size, job.memory.get("in_flight"))
+
+# Function to start the render processes of a memory plan once, for several render_posts calls
+# to share along with their caches. A single worker renders in this process, so there is no pool.
+def open_pool(plan):
+    if plan.workers == 1:
+        return contextlib.nullcontext()
+    return RenderPool(plan.workers, memory.init_worker, (plan.max_cached,))
+
+# Function to render (digest, image, quote) posts into a manifest's directory.
+# Outputs already in the manifest are skipped unless forced; returns every output digest seen.
+# With total (the number of outputs expected), progress events carry an ETA.
+# on_result, if given, is called each time a post comes back from the render pool.
+# plan and pool, from memory_plan and open_pool, are used instead of planning and starting new ones.
+def render_posts(job, posts, manifest, summary, workers=1, force=False, total=None, on_result=None,
+                 plan=None, pool=None):
+    out_dir = manifest.out_dir
+    fmt = job.format()
+    disabled = job.disabled
+    current = set()  # Output digests of this run; tuples per post would grow with the corpus
+    seen = set()
+    plan = plan or memory_plan(job, workers)
+    usage = memory.MemoryUsage(plan)
+    progress = metrics.Progress(total)
+
+    def pending():
+        for digest, im_path, quote in posts:
+            outputs = post_outputs(job, digest)
+            if digest in seen:  # Identical inputs earlier in this run, e.g. a copied background
+                summary["skipped"] += len(outputs)
+                metrics.count("bulkpost_posts_total", len(outputs), status="duplicate")
+                continue
+            seen.add(digest)
+            for _, output_digest in outputs:
+                current.add(output_digest)
+            if job.incremental and not force:
+                stale = [output for output in outputs if not manifest.is_fresh(output[1])]
+                summary["skipped"] += len(outputs) - len(stale)
+                metrics.count("bulkpost_posts_total", len(outputs) - len(stale), status="up_to_date")
+                outputs = stale
+            if outputs:
+                yield (im_path, quote, job.template, disabled, fmt, digest, tuple(variant for variant, _ in outputs),
+                       job.cache_dir)
+
+    with memory.keep_cache_limit(), BackgroundWriter(plan.in_flight) as writer:
+        for result in render_jobs(encode_post, pending(), plan.workers, memory.init_worker, (plan.max_cached,),
+                                  plan.in_flight, pool):
+            usage.observe(result)
+            if on_result:
+                on_result()
+            im_path, quote, _, _, _, digest, todo, _ = result.job
+            if result.error:
+                # Counted per output like rendered and skipped, so the summary adds up to what was planned
+                summary["failed"] += len(todo)
+                summary["failures"].append({"image": im_path, "quote": quote, "error": result.error})
+                print(f"Failed to build {im_path} with quote: {quote} ({result.error})")
+                metrics.count("bulkpost_posts_total", len(todo), status="failed")
+                metrics.event("post_failed", job=job.name, image=im_path, quote=quote, error=result.error)
+                progress.update(summary["rendered"], summary["failed"], summary["skipped"])
+                continue
+            for variant, output in zip(todo, result.output):
+                output_digest = variants.variant_digest(digest, variant)
+                file_name = variants.variant_file_name(quote, output_digest, variant, fmt.ext)
+                writer.write(os.path.join(out_dir, file_name), output)
+                print(f"Output image saved as: {os.path.join(out_dir, file_name)}")
+                manifest.record(output_digest, file_name, im_path, quote)
+                summary["rendered"] += 1
+                metrics.count("bulkpost_posts_total", status="rendered")
+                metrics.event("post_rendered", job=job.name, image=im_path, quote=quote, file=file_name,
+                              digest=output_digest, bytes=len(output))
+                if summary["rendered"] % SAVE_EVERY == 0:
+                    manifest.save()  # Keep progress if the run is interrupted
+                    prune_cache(job)
+            progress.update(summary["rendered"], summary["failed"], summary["skipped"])
+
+    for path, error in writer.errors:  # Not built after all
+        manifest.forget_file(path)
+        summary["rendered"] -= 1
+        summary["failed"] += 1
+        summary["failures"].append({"output": path, "error": error})
+    metrics.count("bulkpost_posts_total", len(writer.errors), status="write_failed")
+    summary["bytes_written"] = summary.get("bytes_written", 0) + writer.bytes_written
+    summary["memory"] = usage.report()
+    summary["workers"] = plan.workers  # Fewer than asked for when the memory budget drops some
+    manifest.save()
+    prune_cache(job)
+    progress.update(summary["rendered"], summary["failed"], summary["skipped"], final=True)
+    return current
+
+# Function to keep a job's on-disk background cache within its size cap
+def prune_cache(job):
+    if job.cache_dir:
+        prune_disk_cache(job.cache_dir, job.disk_cache.get("max_mb", DISK_CACHE_MB))
+
+# Function to add timing to a finished summary; workers is the count asked for,
+# reported unless render_posts recorded how many actually ran
+def finish_summary(summary, started, workers):
+    elapsed = time.perf_counter() - started
+    summary.update(workers=summary.get("workers", workers), elapsed=round(elapsed, 3),
+                   posts_per_sec=round(summary["rendered"] / elapsed, 2) if elapsed else 0.0)
+    if metrics.enabled():
+        metrics.event("run_finished", **{key: value for key, value in summary.items() if key != "failures"})
+        summary["metrics"] = metrics.snapshot()
+    return summary
+
+# Function to run a job headless and return a summary of what happened
+def run_job(job, workers=None, force=False):
+    started = time.perf_counter()
+    workers = resolve_workers(job.workers if workers is None else workers)
+    out_dir = job.output["dir"]
+    summary = new_summary(job, out_dir, images=0, quotes=0)
+    im_paths, quotes = load_inputs(job, summary)
+    metrics.event("run_started", job=job.name, images=summary["images"], workers=workers)
+
+    manifest = BuildManifest(out_dir)
+    current = render_posts(job, iter_posts(job, im_paths, quotes, summary), manifest, summary, workers, force)
+
+    stale = manifest.stale(current)
+    if job.prune and stale:
+        for file_name in manifest.prune(current):
+            print(f"Removed stale post: {os.path.join(out_dir, file_name)}")
+        manifest.save()
+        stale = []
+    summary["stale"] = len(stale)
+    return finish_summary(summary, started, workers)
@@ -0,0 +1,138 @@
+from PIL import ImageDraw
+
+from bulkpost.assets import get_font
+
+# Share of the canvas the quote may cover, centered
+BOX_WIDTH = 0.86
+BOX_HEIGHT = 0.45  # Stays clear of the logo above the trademark
+MIN_FONT_SIZE = 40
+LINE_SPACING = -10 / 115  # Gap between lines as a share of the font size (the original -10px at 115px)
+REFERENCE_SIZE = 100  # Size at which widths are measured for the font size search
+MAX_CACHED_WORDS = 200000  # Per font and size
+
+_advances = {}
+stats = {"hits": 0, "misses": 0}
+
+# Function to get the memo of word advance widths for one font and size
+def _widths(font):
+    key = (font.path, font.size)
+    widths = _advances.get(key)
+    if widths is None or len(widths) > MAX_CACHED_WORDS:
+        widths = _advances[key] = {}
+    return widths
+
+# Function to get the advance width of a word (or a single space) in pixels
+def word_width(font, word):
+    widths = _widths(font)
+    width = widths.get(word)
+    if width is None:
+        stats["misses"] += 1
+        width = widths[word] = font.getlength(word)
+    else:
+        stats["hits"] += 1
+    return width
+
+# Function to get the height of one line of text (the ascent, like the original textbbox bottom)
+def line_height(font):
+    return font.getmetrics()[0]
+
+# Function to split a word that is wider than max_width into pieces that fit
+def _split_word(font, word, max_width):
+    pieces, piece = [], ""
+    for char in word:
+        if piece and word_width(font, piece + char) > max_width:
+            pieces.append(piece)
+            piece = char
+        else:
+            piece += char
+    return pieces + [piece] if piece else pieces
+
+# Function to wrap text by measured pixel width; explicit newlines always start a new line
+def wrap(text, font, max_width):
+    space = word_width(font, " ")
+    lines = []
+    for paragraph in text.split("\n"):
+        line, line_w = [], 0.0
+        for word in paragraph.split():
+            w = word_width(font, word)
+            if w > max_width:
+                if line:
+                    lines.append(" ".join(line))
+                *full, last = _split_word(font, word, max_width)
+                lines.extend(full)
+                line, line_w = [last], word_width(font, last)
+            elif line and line_w + space + w > max_width:
+                lines.append(" ".join(line))
+                line, line_w = [word], w
+            else:
+                line_w += (space if line else 0) + w
+                line.append(word)
+        if line:
+            lines.append(" ".join(line))
+    return lines
+
+# Function to get the height of a block of n lines
+def block_height(font, n_lines):
+    return n_lines * line_height(font) + (n_lines - 1) * round(LINE_SPACING * font.size)
+
+# Function to check whether text wrapped at the given font fits the box
+def _fits(font, text, box_w, box_h):
+    lines = wrap(text, font, box_w)
+    return block_height(font, len(lines)) <= box_h, lines
+
+# Function to pick the largest font size between min_size and max_size at which text fits the box.
+# Sizes are searched with widths measured once at REFERENCE_SIZE and scaled, then confirmed at
+# the real size, so a batch of quotes mostly costs dictionary lookups.
+def fit_text(text, font_path, box_w, box_h, max_size=115, min_size=MIN_FONT_SIZE):
+    ref = get_font(font_path, REFERENCE_SIZE)
+    lo, hi = min_size, max_size
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        scale = REFERENCE_SIZE / mid
+        lines = wrap(text, ref, box_w * scale)
+        if block_height(ref, len(lines)) <= box_h * scale:
+            lo = mid
+        else:
+            hi = mid - 1
+    size = lo
+    while True:
+        font = get_font(font_path, size)
+        fits, lines = _fits(font, text, box_w, box_h)
+        if fits or size <= min_size:
+            return font, lines
+        size -= 1
+
+# Result of laying out a quote: the chosen font and each line with its top-left position
+class QuoteLayout:
+    def __init__(self, font, lines, positions):
+        self.font = font
+        self.lines = lines
+        self.positions = positions
+
+# Function to lay out a quote centered on a canvas of the given size
+def layout_quote(quote, font_path, canvas_size, max_size=115, min_size=MIN_FONT_SIZE,
+                 box_width=BOX_WIDTH, box_height=BOX_HEIGHT):
+    W, H = canvas_size
+    font, lines = fit_text(quote, font_path, W * box_width, H * box_height, max_size, min_size)
+    step = line_height(font) + round(LINE_SPACING * font.size)
+    current_h = H / 2 - block_height(font, len(lines)) / 2
+    space = word_width(font, " ")
+    positions = []
+    for line in lines:
+        words = line.split(" ")
+        width = sum(word_width(font, word) for word in words) + space * (len(words) - 1)
+        positions.append(((W - width) / 2, current_h))
+        current_h += step
+    return QuoteLayout(font, lines, positions)
+
+# Function to draw a laid out quote onto the image
+def draw_layout(im, layout, fill="white"):
+    draw = ImageDraw.Draw(im)
+    for line, position in zip(layout.lines, layout.positions):
+        draw.text(position, line, font=layout.font, fill=fill)
+
+# Function to place the quote in the center of the image, sized to fit
+def place_quote(im, quote, font_path, max_size=115, min_size=MIN_FONT_SIZE):
+    layout = layout_quote(quote, font_path, im.size, max_size, min_size)
+    draw_layout(im, layout)
+    return layout
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+import re
+
+MANIFEST_NAME = "manifest.json"
+
+_file_digests = {}
+
+# Function to hash a file's bytes, once per (path, mtime, size)
+def file_digest(path):
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    digest = _file_digests.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = _file_digests[key] = h.hexdigest()
+    return digest
+
+# Function to content-address a post by everything that affects its pixels
+def post_digest(im_path, quote, font_path, logo_path=None, params=None):
+    inputs = {
+        "background": file_digest(im_path),
+        "quote": quote,
+        "font": file_digest(font_path),
+        "logo": file_digest(logo_path) if logo_path else None,
+        "params": params or {},
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Function to build a readable, collision-free output name from a quote and its digest
+def post_file_name(quote, digest, ext="png"):
+    prefix = re.sub(r'[^0-9A-Za-z]+', '_', quote[:10]).strip('_') or "post"
+    return f"{prefix}_{digest[:12]}.{ext}"
+
+# Record of which posts were rendered from which inputs, stored next to the outputs
+class BuildManifest:
+    def __init__(self, out_dir="out"):
+        self.out_dir = out_dir
+        self.path = os.path.join(out_dir, MANIFEST_NAME)
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get("posts", {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable manifest {self.path}: {e}")
+
+    # Function to check whether a post was already rendered and its output still exists
+    def is_fresh(self, digest):
+        entry = self.entries.get(digest)
+        return entry is not None and os.path.exists(os.path.join(self.out_dir, entry["file"]))
+
+    def record(self, digest, file_name, im_path, quote):
+        self.entries[digest] = {"file": file_name, "image": im_path, "quote": quote}
+
+    # Function to forget the post written to path, e.g. because writing it failed
+    def forget_file(self, path):
+        file_name = os.path.relpath(path, self.out_dir)
+        for digest in [digest for digest, entry in self.entries.items() if entry["file"] == file_name]:
+            del self.entries[digest]
+
+    # Function to list entries whose inputs are no longer part of the job set
+    def stale(self, current_digests):
+        return {digest: entry for digest, entry in self.entries.items() if digest not in current_digests}
+
+    # Function to delete stale outputs and forget them
+    def prune(self, current_digests):
+        removed = []
+        for digest, entry in self.stale(current_digests).items():
+            try:
+                os.remove(os.path.join(self.out_dir, entry["file"]))
+            except FileNotFoundError:
+                pass
+            removed.append(entry["file"])
+            del self.entries[digest]
+        return removed
+
+    def save(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"posts": self.entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,141 @@
+import contextlib
+import math
+import os
+import sys
+import threading
+
+from PIL import Image
+
+from bulkpost import backgrounds
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Rough fixed cost of a render process (interpreter, Pillow, fonts, overlays), in MB.
+# `python -m bulkpost bench` reports the real figure for a machine.
+WORKER_OVERHEAD_MB = 80
+FRAMES_PER_RENDER = 3  # Working frame plus the decode/resize temporaries of a cache miss
+MIN_CACHED = 2  # Fewer prepared backgrounds than this and every post becomes a cache miss
+IN_FLIGHT_PER_WORKER = 2  # Encoded posts queued per worker when no limit is given
+PILLOW_BLOCKS = 16  # Freed image blocks Pillow keeps for reuse in each process
+
+_frames = threading.local()
+_variant_frames = {}
+
+# Function to read the current resident set size in bytes (Linux), or None
+def current_rss():
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+# Function to read the peak resident set size of this process in bytes, or None
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+# Function to get the size of one canvas in MB; Pillow stores RGB pixels in 4 bytes
+def frame_mb(size):
+    return size[0] * size[1] * 4 / 2**20
+
+# How many workers, cached backgrounds and in-flight posts a run can afford
+class MemoryPlan:
+    def __init__(self, workers, max_cached, in_flight, budget_mb=None, size=backgrounds.DEFAULT_SIZE):
+        self.workers = workers
+        self.max_cached = max_cached
+        self.in_flight = in_flight
+        self.budget_mb = budget_mb
+        self.size = tuple(size)
+
+    # Function to estimate the peak RSS of the whole run in MB
+    def estimate_mb(self):
+        frame = frame_mb(self.size)
+        worker = WORKER_OVERHEAD_MB + (self.max_cached + FRAMES_PER_RENDER) * frame
+        main = WORKER_OVERHEAD_MB + self.in_flight * frame
+        return round(worker if self.workers == 1 else main + self.workers * worker, 1)
+
+    def as_dict(self):
+        return {"budget_mb": self.budget_mb, "workers": self.workers, "max_cached": self.max_cached,
+                "in_flight": self.in_flight, "estimate_mb": self.estimate_mb()}
+
+# Function to fit workers, the per-worker background cache and the in-flight limit into a budget.
+# Without a budget, backgrounds.MAX_CACHED is shared out between the workers.
+# Workers are dropped before the cache gets too small.
+def plan_memory(budget_mb=None, workers=1, size=backgrounds.DEFAULT_SIZE, in_flight=None):
+    if not budget_mb:
+        max_cached = max(MIN_CACHED, backgrounds.MAX_CACHED // workers)
+        return MemoryPlan(workers, max_cached, in_flight or workers * IN_FLIGHT_PER_WORKER, None, size)
+    frame = frame_mb(size)
+    for n in range(workers, 0, -1):
+        flight = in_flight or n * IN_FLIGHT_PER_WORKER
+        main = 0 if n == 1 else WORKER_OVERHEAD_MB + flight * frame  # One worker renders in-process
+        max_cached = math.floor(((budget_mb - main) / n - WORKER_OVERHEAD_MB) / frame) - FRAMES_PER_RENDER
+        if max_cached >= MIN_CACHED:
+            if n < workers:
+                print(f"Memory budget of {budget_mb} MB fits {n} of {workers} workers")
+            return MemoryPlan(n, min(max_cached, backgrounds.MAX_CACHED), flight, budget_mb, size)
+    needed = WORKER_OVERHEAD_MB + (MIN_CACHED + FRAMES_PER_RENDER) * frame
+    raise ValueError(f"A memory budget of {budget_mb} MB is too small; one worker needs about {math.ceil(needed)} MB")
+
+# Function to set up a render process for a plan: cache size and Pillow's block reuse.
+# A single worker renders in this process, so runs wrap it in keep_cache_limit.
+def init_worker(max_cached):
+    backgrounds.MAX_CACHED = max_cached
+    with backgrounds._lock:
+        while len(backgrounds._prepared) > max_cached:
+            backgrounds._prepared.popitem(last=False)
+    Image.core.set_blocks_max(PILLOW_BLOCKS)
+
+# Function to restore this process's background cache limit after a run that may change it,
+# so the next job in the same process is planned from the default again
+@contextlib.contextmanager
+def keep_cache_limit():
+    previous = backgrounds.MAX_CACHED
+    try:
+        yield
+    finally:
+        backgrounds.MAX_CACHED = previous
+
+# Function to get this thread's reusable canvas of the given size.
+# A post is drawn into it and encoded before the next one starts, so no per-post frame is allocated.
+def get_frame(size, mode="RGB"):
+    frame = getattr(_frames, "frame", None)
+    if frame is None or frame.size != tuple(size) or frame.mode != mode:
+        frame = _frames.frame = Image.new(mode, tuple(size))
+    return frame
+
+# Function to get this process's reusable canvas for one output variant of a post.
+# A process renders one post at a time, so the threads drawing its variants never share a canvas.
+def get_variant_frame(name, size, mode="RGB"):
+    frame = _variant_frames.get(name)
+    if frame is None or frame.size != tuple(size) or frame.mode != mode:
+        frame = _variant_frames[name] = Image.new(mode, tuple(size))
+    return frame
+
+# Peak memory of a run: this process plus the peak reported by each worker process
+class MemoryUsage:
+    def __init__(self, plan=None):
+        self.plan = plan
+        self.workers = {}
+
+    # Function to record the peak RSS a job result reports for its worker process
+    def observe(self, result):
+        if result.pid is not None and result.peak_rss is not None and result.pid != os.getpid():
+            self.workers[result.pid] = max(self.workers.get(result.pid, 0), result.peak_rss)
+
+    def report(self):
+        main = peak_rss() or 0
+        total = main + sum(self.workers.values())
+        report = {"main_peak_mb": round(main / 2**20, 1),
+                  "worker_peak_mb": round(max(self.workers.values(), default=0) / 2**20, 1),
+                  "total_peak_mb": round(total / 2**20, 1)}
+        if self.plan is not None:
+            report.update(self.plan.as_dict())
+            if self.plan.budget_mb:
+                report["within_budget"] = total / 2**20 <= self.plan.budget_mb
+        return report
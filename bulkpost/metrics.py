@@ -0,0 +1,310 @@
+import json
+import math
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Instrumentation for long runs. Code reports through count(), observe(), timed() and event();
+# what happens to the reports depends on the sinks that are enabled. With no sink enabled
+# every call returns after one check of an empty list, so instrumented code pays almost nothing.
+#
+# Metric names follow Prometheus conventions: *_total counters, *_seconds histograms.
+# Worker processes buffer their reports and send them back with each job result
+# (see render_engine), so the main process sees the timings of every worker.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_PROGRESS_INTERVAL = 10.0  # Seconds between progress events
+METRICS_PATH = "/metrics"
+
+_sinks = []
+_NULL = nullcontext()
+progress_interval = DEFAULT_PROGRESS_INTERVAL
+
+# Base class of a sink: every report is ignored unless a subclass handles it
+class Sink:
+    def count(self, name, value, labels):
+        pass
+
+    def observe(self, name, value, labels):
+        pass
+
+    def event(self, name, fields):
+        pass
+
+    def close(self):
+        pass
+
+# Counters and histograms kept in memory, readable as a dict or as Prometheus text
+class Registry(Sink):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def count(self, name, value, labels):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels):
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0,
+                                                    "count": 0, "max": 0.0}
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            histogram["counts"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+            histogram["max"] = max(histogram["max"], value)
+
+    # Function to estimate a quantile of a histogram from its buckets (the upper bound of the bucket)
+    def quantile(self, histogram, q):
+        rank, seen = math.ceil(q * histogram["count"]), 0
+        for bound, count in zip(self.buckets + (histogram["max"],), histogram["counts"]):
+            seen += count
+            if seen >= rank:
+                return min(bound, histogram["max"])
+        return histogram["max"]
+
+    # Function to get every counter and histogram as plain data, e.g. for a run summary
+    def snapshot(self):
+        with self.lock:
+            counters = {_series(name, labels): value for (name, labels), value in self.counters.items()}
+            histograms = {_series(name, labels): {"count": h["count"], "sum": round(h["sum"], 4),
+                                                  "mean": round(h["sum"] / h["count"], 4) if h["count"] else 0.0,
+                                                  "p50": round(self.quantile(h, 0.5), 4),
+                                                  "p95": round(self.quantile(h, 0.95), 4),
+                                                  "max": round(h["max"], 4)}
+                          for (name, labels), h in self.histograms.items()}
+        return {"counters": counters, "histograms": histograms}
+
+    # Function to render the registry in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (series, labels), value in sorted(self.counters.items()):
+                    if series == name:
+                        lines.append(f"{_series(name, labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (series, labels), h in sorted(self.histograms.items()):
+                    if series != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (math.inf,), h["counts"]):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else repr(bound)
+                        lines.append(f"{_series(name + '_bucket', labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{_series(name + '_sum', labels)} {h['sum']}")
+                    lines.append(f"{_series(name + '_count', labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+# Events written as one JSON object per line, to a file or a stream such as stderr
+class JsonLogSink(Sink):
+    def __init__(self, path_or_stream):
+        self.own = isinstance(path_or_stream, str)
+        self.stream = open(path_or_stream, 'a', encoding='utf-8') if self.own else path_or_stream
+        self.lock = threading.Lock()
+
+    def event(self, name, fields):
+        line = json.dumps(dict({"ts": round(time.time(), 3), "event": name}, **fields), default=str)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def close(self):
+        if self.own:
+            self.stream.close()
+
+# Progress events printed as a readable line for people watching a run
+class ConsoleSink(Sink):
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+
+    def event(self, name, fields):
+        if name != "progress":
+            return
+        eta = f", ETA {fields['eta_s']:.0f}s" if fields.get("eta_s") is not None else ""
+        total = f"/{fields['total']}" if fields.get("total") else ""
+        print(f"Progress: {fields['done']}{total} done, {fields['failed']} failed, {fields['skipped']} skipped, "
+              f"{fields['per_sec']}/s{eta}", file=self.stream, flush=True)
+
+# Reports kept in a worker process until render_engine ships them back with a job result
+class Buffer(Sink):
+    def __init__(self):
+        self.records = []
+
+    def count(self, name, value, labels):
+        self.records.append(("count", name, value, labels))
+
+    def observe(self, name, value, labels):
+        self.records.append(("observe", name, value, labels))
+
+    def event(self, name, fields):
+        self.records.append(("event", name, fields, None))
+
+# Function to turn a name and label pairs into a Prometheus series name
+def _series(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+# Function to tell whether any sink is listening
+def enabled():
+    return bool(_sinks)
+
+# Function to start sending reports to a sink
+def add_sink(sink):
+    _sinks.append(sink)
+    return sink
+
+# Function to stop every sink, closing their files
+def reset():
+    for sink in _sinks:
+        sink.close()
+    _sinks.clear()
+
+# Function to add value to a counter
+def count(name, value=1, **labels):
+    if _sinks and value:
+        labels = tuple(sorted(labels.items()))
+        for sink in _sinks:
+            sink.count(name, value, labels)
+
+# Function to record one measurement in a histogram
+def observe(name, value, **labels):
+    if _sinks:
+        labels = tuple(sorted(labels.items()))
+        for sink in _sinks:
+            sink.observe(name, value, labels)
+
+# Function to emit a structured event, e.g. a post rendered or a run finished
+def event(name, **fields):
+    if _sinks:
+        for sink in _sinks:
+            sink.event(name, fields)
+
+# Timer context that records its duration in a histogram when it exits
+class _Timer:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+# Function to time a block into a histogram: `with metrics.timed("bulkpost_render_seconds"): ...`
+def timed(name, **labels):
+    return _Timer(name, labels) if _sinks else _NULL
+
+# Function to set up a worker process: buffer reports when the parent process is instrumented
+def init_worker(instrumented):
+    _sinks.clear()  # Sinks inherited through fork belong to the parent
+    if instrumented:
+        _sinks.append(Buffer())
+
+# Function to take the reports a worker process buffered since the last call, or None
+def drain():
+    for sink in _sinks:
+        if isinstance(sink, Buffer):
+            records, sink.records = sink.records, []
+            return records
+    return None
+
+# Function to feed reports drained from a worker process into this process's sinks
+def replay(records):
+    for kind, name, value, labels in records or ():
+        if kind == "event":
+            event(name, **value)
+        else:
+            for sink in _sinks:
+                getattr(sink, kind)(name, value, labels)
+
+# Throughput, failure rate and ETA of a run, emitted as a "progress" event every interval seconds
+class Progress:
+    def __init__(self, total=None, interval=None):
+        self.total = total
+        self.interval = progress_interval if interval is None else interval
+        self.started = self.last = time.perf_counter()
+
+    # Function to report the counts so far; emits at most once per interval unless final
+    def update(self, done, failed=0, skipped=0, final=False):
+        if not _sinks:
+            return
+        now = time.perf_counter()
+        if not final and now - self.last < self.interval:
+            return
+        self.last = now
+        elapsed = now - self.started
+        per_sec = done / elapsed if elapsed else 0.0
+        remaining = self.total - done - failed - skipped if self.total else None
+        event("progress", done=done, failed=failed, skipped=skipped, total=self.total,
+              per_sec=round(per_sec, 2), failure_rate=round(failed / (done + failed), 4) if done + failed else 0.0,
+              elapsed_s=round(elapsed, 1),
+              eta_s=round(max(0, remaining) / per_sec, 1) if remaining is not None and per_sec else None)
+
+# Function to serve a registry as Prometheus text on a local port, from a daemon thread
+def serve(registry, port, host="127.0.0.1"):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != METRICS_PATH:
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would otherwise flood stderr
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+# Function to get the counters and histograms of the enabled registry, or None
+def snapshot():
+    registry = next((sink for sink in _sinks if isinstance(sink, Registry)), None)
+    return registry.snapshot() if registry is not None else None
+
+# Function to add the instrumentation options to an argparse parser.
+# With progress, also --progress-every for runs that report progress events.
+def add_metrics_arguments(parser, progress=False):
+    parser.add_argument("--metrics-log", metavar="PATH",
+                        help="append structured JSON events to PATH ('-' for stderr)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus-style metrics on http://127.0.0.1:PORT/metrics during the run")
+    if progress:
+        parser.add_argument("--progress-every", type=float, metavar="SECONDS",
+                            help="print throughput, failures and ETA every SECONDS")
+
+# Function to enable the sinks asked for on the command line; returns the registry, or None when off
+def metrics_from_args(args):
+    global progress_interval
+    progress_every = getattr(args, "progress_every", None)
+    if not (args.metrics_log or args.metrics_port or progress_every):
+        return None
+    registry = add_sink(Registry())
+    if args.metrics_log:
+        add_sink(JsonLogSink(sys.stderr if args.metrics_log == "-" else args.metrics_log))
+    if progress_every:
+        progress_interval = progress_every
+        add_sink(ConsoleSink())
+    if args.metrics_port:
+        serve(registry, args.metrics_port)
+        print(f"Serving metrics on http://127.0.0.1:{args.metrics_port}{METRICS_PATH}", file=sys.stderr)
+    return registry
@@ -0,0 +1,219 @@
+import itertools
+import json
+import os
+import random
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageColor
+
+from bulkpost import layout, templates
+from bulkpost.backgrounds import crop_box
+from bulkpost.discovery import load_index, save_index
+from bulkpost.tint import apply_tint
+
+FEATURES_PATH = os.path.join(".cache", "pairing.json")
+FEATURES_VERSION = 2
+THUMB_SIZE = 64  # Backgrounds are judged from a thumbnail of the canvas area
+NEAR_DUPLICATE_BITS = 6  # Difference hashes this close (of 64 bits) are the same picture
+NEAR_DUPLICATE_COLOR = 12  # ...if their mean colors also differ by at most this much in every channel
+# Hashes with fewer set or clear bits than this come from flat or smooth pictures (solid colors,
+# gradients), which all hash alike however they look, so they are never treated as duplicates
+MIN_HASH_DETAIL = 8
+MIN_CONTRAST = 3.0  # WCAG contrast for large text, between the quote fill and the brighter parts of the box
+# Light text is judged against the bright end of the box, dark text against its dark end
+BRIGHT_PERCENTILE = 0.9
+DARK_PERCENTILE = 0.1
+ANALYZE_THREADS = 8
+QUOTE_CHUNK = 1000  # Quotes held at once when every background is paired with every quote
+
+# What the pairing engine knows about one background: a 64-bit difference hash and the mean
+# (r, g, b) color of the whole picture, and the mean, dark and bright percentile luminance (0-255)
+# of the quote box after tinting
+BackgroundStats = namedtuple("BackgroundStats", ["path", "hash", "color", "mean", "dark", "bright"])
+
+# Function to compute the difference hash of an image: one bit per neighbouring pixel pair
+def dhash(im):
+    small = im.convert('L').resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = bits << 1 | (pixels[row * 9 + col] < pixels[row * 9 + col + 1])
+    return bits
+
+# Function to count the bits two hashes differ in
+def hash_distance(a, b):
+    return bin(a ^ b).count("1")
+
+# Function to tell whether a hash has enough detail to identify a picture
+def is_detailed(hash_bits, min_detail=MIN_HASH_DETAIL):
+    return min_detail <= bin(hash_bits).count("1") <= 64 - min_detail
+
+# Function to tell whether two backgrounds are the same picture: close hashes and close mean colors
+def is_near_duplicate(a, b, max_bits=NEAR_DUPLICATE_BITS, max_color=NEAR_DUPLICATE_COLOR):
+    return (hash_distance(a.hash, b.hash) <= max_bits
+            and max(abs(x - y) for x, y in zip(a.color, b.color)) <= max_color)
+
+# Function to get the relative luminance (0-1) of an sRGB value or (r, g, b) color
+def relative_luminance(color):
+    if isinstance(color, (int, float)):
+        color = (color,) * 3
+    linear = [c / 255 / 12.92 if c / 255 <= 0.04045 else ((c / 255 + 0.055) / 1.055) ** 2.4 for c in color]
+    return 0.2126 * linear[0] + 0.7152 * linear[1] + 0.0722 * linear[2]
+
+# Function to get the WCAG contrast ratio between two colors
+def contrast(a, b):
+    la, lb = relative_luminance(a), relative_luminance(b)
+    return (max(la, lb) + 0.05) / (min(la, lb) + 0.05)
+
+# Function to get the luminance below which a share of a histogram's pixels fall
+def _percentile(histogram, share):
+    total, seen = sum(histogram), 0
+    for value, count in enumerate(histogram):
+        seen += count
+        if seen >= total * share:
+            return value
+    return 255
+
+# Function to get the settings of a template that change how a background looks under the quote
+def _settings_key(template):
+    return json.dumps([list(template.size), templates.background_options(template)], sort_keys=True)
+
+# Function to hash a background and measure its quote box the way the template will tint it
+def analyze(path, template):
+    options = templates.background_options(template)
+    with Image.open(path) as src:
+        src.draft('RGB', (THUMB_SIZE * 4, THUMB_SIZE * 4))
+        im = src.convert('RGB')
+    hash_bits = dhash(im)
+    color = list(im.resize((1, 1), Image.Resampling.BOX).getpixel((0, 0)))
+    box = crop_box(im.size, template.size) if options["fit"] == "crop" else (0, 0) + im.size
+    w, h = template.size
+    thumb_size = (THUMB_SIZE, max(1, round(THUMB_SIZE * h / w)))
+    thumb = apply_tint(im.resize(thumb_size, Image.Resampling.BILINEAR, box=box), options["tint_color"],
+                       options["brightness"], options["gradient"], options["vignette"])
+    tw, th = thumb.size
+    quote_box = (round(tw * (1 - layout.BOX_WIDTH) / 2), round(th * (1 - layout.BOX_HEIGHT) / 2),
+                 round(tw * (1 + layout.BOX_WIDTH) / 2), round(th * (1 + layout.BOX_HEIGHT) / 2))
+    histogram = thumb.crop(quote_box).convert('L').histogram()
+    mean = sum(value * count for value, count in enumerate(histogram)) / sum(histogram)
+    return hash_bits, color, [round(mean, 1), _percentile(histogram, DARK_PERCENTILE), _percentile(histogram, BRIGHT_PERCENTILE)]
+
+# Function to get the stats of backgrounds for a template, analyzing each file only once.
+# Results are cached in FEATURES_PATH by path, mtime and size; unreadable files are left out.
+def background_stats(paths, template, index_path=FEATURES_PATH):
+    key = _settings_key(template)
+    index = load_index(index_path, FEATURES_VERSION) if index_path else {}
+    stats, todo = {}, []
+    for path in paths:
+        st = os.stat(path)
+        entry = index.get(os.path.abspath(path))
+        if entry is not None and entry[:2] == [st.st_mtime_ns, st.st_size] and key in entry[4]:
+            stats[path] = BackgroundStats(path, int(entry[2], 16), tuple(entry[3]), *entry[4][key])
+        else:
+            todo.append((path, st))
+
+    def measure(item):
+        try:
+            return analyze(item[0], template)
+        except Exception as e:  # Unreadable backgrounds are reported by discovery already
+            print(f"Could not analyze {item[0]}: {type(e).__name__}: {e}")
+            return None
+
+    if todo:
+        with ThreadPoolExecutor(ANALYZE_THREADS) as pool:
+            for (path, st), result in zip(todo, pool.map(measure, todo)):
+                if result is None:
+                    continue
+                hash_bits, color, looks = result
+                stats[path] = BackgroundStats(path, hash_bits, tuple(color), *looks)
+                entry = index.get(os.path.abspath(path))
+                by_settings = entry[4] if entry is not None and entry[:2] == [st.st_mtime_ns, st.st_size] else {}
+                by_settings[key] = looks
+                index[os.path.abspath(path)] = [st.st_mtime_ns, st.st_size, f"{hash_bits:016x}", color, by_settings]
+        if index_path:
+            save_index(index, index_path, FEATURES_VERSION)
+    return [stats[path] for path in paths if path in stats]
+
+# Function to split backgrounds into distinct ones and near-duplicates of an earlier one.
+# Hashes within max_bits share at least one of max_bits + 1 bands exactly, so only
+# backgrounds in a common band bucket are compared. Backgrounds without enough detail
+# in their hash are always kept.
+def drop_near_duplicates(stats, max_bits=NEAR_DUPLICATE_BITS, max_color=NEAR_DUPLICATE_COLOR):
+    bands = max_bits + 1
+    widths = [64 // bands + (i < 64 % bands) for i in range(bands)]
+    buckets = {}
+    kept, dropped = [], []
+    for item in stats:
+        if not is_detailed(item.hash):
+            kept.append(item)
+            continue
+        keys, shift = [], 64
+        for i, width in enumerate(widths):
+            shift -= width
+            keys.append((i, item.hash >> shift & ((1 << width) - 1)))
+        candidates = {id(other): other for key in keys for other in buckets.get(key, ())}
+        original = next((other for other in candidates.values()
+                         if is_near_duplicate(item, other, max_bits, max_color)), None)
+        if original is not None:
+            dropped.append((item.path, original.path))
+            continue
+        kept.append(item)
+        for key in keys:
+            buckets.setdefault(key, []).append(item)
+    return kept, dropped
+
+# Function to tell whether the template's quote color stands out from a background
+def is_readable(item, template, min_contrast=MIN_CONTRAST):
+    fill = template.quote.get("fill", "white")
+    fill = tuple(fill[:3]) if isinstance(fill, list) else ImageColor.getrgb(fill)[:3]
+    light_text = relative_luminance(fill) > relative_luminance(item.mean)
+    return contrast(fill, item.bright if light_text else item.dark) >= min_contrast
+
+# Function to pick the backgrounds worth pairing: near-duplicates and backgrounds the quote
+# would be unreadable on are left out. Returns the kept paths and a report of what was dropped.
+def curate(paths, template, dedupe=True, min_contrast=MIN_CONTRAST, index_path=FEATURES_PATH):
+    stats = background_stats(paths, template, index_path)
+    report = {"near_duplicates": [], "unreadable": []}
+    if min_contrast:
+        readable = []
+        for item in stats:
+            if is_readable(item, template, min_contrast):
+                readable.append(item)
+            else:
+                report["unreadable"].append(item.path)
+        stats = readable
+    if dedupe:
+        stats, report["near_duplicates"] = drop_near_duplicates(stats)
+    for path, original in report["near_duplicates"]:
+        print(f"Skipping {path}: near-duplicate of {original}")
+    for path in report["unreadable"]:
+        print(f"Skipping {path}: the quote would be hard to read on it after tinting")
+    return [item.path for item in stats], report
+
+# Function to hand out backgrounds evenly: every background once, in a shuffled order,
+# before any repeats. The next round is reshuffled without starting on the last one used.
+def spread(paths, seed=None):
+    rng = random.Random(seed)
+    order = list(paths)
+    last = None
+    while order:
+        rng.shuffle(order)
+        if len(order) > 1 and order[0] == last:
+            order[0], order[-1] = order[-1], order[0]
+        yield from order
+        last = order[-1]
+
+# Function to pair every background with every quote, reading the quotes a chunk at a time.
+# Backgrounds are the outer loop, so each is prepared once per chunk rather than once per quote
+# and the background cache keeps hitting however many backgrounds there are.
+def all_combinations(paths, quotes, chunk_size=QUOTE_CHUNK):
+    quotes = iter(quotes)
+    while True:
+        chunk = list(itertools.islice(quotes, chunk_size))
+        if not chunk:
+            return
+        for path in paths:
+            for quote in chunk:
+                yield path, quote
@@ -0,0 +1,233 @@
+import queue
+import threading
+import time
+
+from bulkpost import metrics
+from bulkpost.render_engine import render_jobs
+
+DEFAULT_QUEUE_SIZE = 16
+
+# Marker passed down a queue when the stage feeding it has finished
+_DONE = object()
+
+# Function to run fn(*args) in a pool process and return (result, seconds it took)
+def _timed_call(fn, *args):
+    start = time.perf_counter()
+    return fn(*args), time.perf_counter() - start
+
+# One step of the pipeline: a function run by a number of worker threads, or for a pool stage
+# by a number of worker processes fed from one thread (see render_engine.render_jobs)
+class Stage:
+    def __init__(self, name, fn, workers=1, queue_size=DEFAULT_QUEUE_SIZE, expand=False, pool=False):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.expand = expand  # fn returns an iterable of items instead of a single item
+        self.pool = pool
+        self.threads = 1 if pool else self.workers
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.in_flight = 0  # Items taken from the inbox and not finished yet
+        self.processed = 0
+        self.emitted = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.max_depth = 0
+        self.lock = threading.Lock()
+
+    def stats(self, elapsed):
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "queue_depth": self.inbox.qsize(),
+            "max_queue_depth": self.max_depth,
+            "queue_size": self.inbox.maxsize,
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "emitted": self.emitted,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy, 3),
+            "items_per_second": round(self.processed / elapsed, 2) if elapsed else 0.0,
+            "utilization": round(self.busy / (elapsed * self.workers), 3) if elapsed else 0.0,
+        }
+
+# Streaming producer/consumer pipeline with bounded queues between stages.
+# Items flow from source through every stage; each queue holds at most queue_size
+# items, so a slow stage throttles the ones before it instead of buffering everything.
+class Pipeline:
+    def __init__(self, source, name="fetch", queue_size=DEFAULT_QUEUE_SIZE):
+        self.source = source
+        self.source_stage = Stage(name, None, 1, queue_size)
+        self.stages = []
+        self.outbox = queue.Queue(maxsize=queue_size)
+        self.started = None
+        self.finished = None
+
+    def add_stage(self, name, fn, workers=1, queue_size=DEFAULT_QUEUE_SIZE, expand=False):
+        self.stages.append(Stage(name, fn, workers, queue_size, expand))
+        return self
+
+    # Function to add a stage that runs fn(*item) on a pool of worker processes. It emits a
+    # render_engine.JobResult per item, in order; failures come through with their error set.
+    # fn must be a module-level function so the processes can load it.
+    def add_pool_stage(self, name, fn, workers=1, queue_size=DEFAULT_QUEUE_SIZE):
+        self.stages.append(Stage(name, fn, workers, queue_size, pool=True))
+        return self
+
+    # Function to put an item on a queue while tracking how deep it gets
+    def _put(self, stage, target, item):
+        target.put(item)
+        if stage is not None:
+            depth = target.qsize()
+            if depth > stage.max_depth:
+                stage.max_depth = depth
+
+    def _next_inbox(self, index):
+        if index + 1 < len(self.stages):
+            return self.stages[index + 1], self.stages[index + 1].inbox
+        return None, self.outbox
+
+    def _finish(self, index):
+        next_stage, target = self._next_inbox(index)
+        for _ in range(next_stage.threads if next_stage else 1):
+            target.put(_DONE)
+
+    def _produce(self):
+        stage = self.source_stage
+        first = self.stages[0] if self.stages else None
+        target = first.inbox if first else self.outbox
+        items = iter(self.source)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    stage.errors += 1
+                    print(f"Error in stage '{stage.name}': {e}")
+                    break
+                finally:
+                    stage.busy += time.perf_counter() - start
+                stage.processed += 1
+                stage.emitted += 1
+                self._put(first, target, item)
+        finally:
+            for _ in range(first.threads if first else 1):
+                target.put(_DONE)
+
+    def _work(self, index, remaining):
+        stage = self.stages[index]
+        next_stage, target = self._next_inbox(index)
+        while True:
+            item = stage.inbox.get()
+            if item is _DONE:
+                break
+            with stage.lock:
+                stage.in_flight += 1
+            start = time.perf_counter()
+            try:
+                result = stage.fn(item)
+                results = list(result) if stage.expand else [result]
+            except Exception as e:
+                results = []
+                with stage.lock:
+                    stage.errors += 1
+                print(f"Error in stage '{stage.name}': {type(e).__name__}: {e}")
+            self._done(stage, time.perf_counter() - start)
+            self._emit(stage, next_stage, target, results)
+        self._stopped(index, remaining)
+
+    # Function to feed a pool stage's inbox to its worker processes and pass their results on
+    def _work_pool(self, index, remaining):
+        stage = self.stages[index]
+        next_stage, target = self._next_inbox(index)
+
+        def jobs():
+            while True:
+                item = stage.inbox.get()
+                if item is _DONE:
+                    return
+                with stage.lock:
+                    stage.in_flight += 1
+                yield (stage.fn,) + tuple(item)
+
+        for result in render_jobs(_timed_call, jobs(), stage.workers):
+            output, busy = result.output if result.error is None else (None, 0.0)
+            if result.error:
+                with stage.lock:
+                    stage.errors += 1
+            self._done(stage, busy)
+            self._emit(stage, next_stage, target, [result._replace(job=result.job[1:], output=output)])
+        self._stopped(index, remaining)
+
+    # Function to account for one finished item of a stage
+    def _done(self, stage, busy):
+        metrics.observe("bulkpost_stage_seconds", busy, stage=stage.name)
+        with stage.lock:
+            stage.in_flight -= 1
+            stage.busy += busy
+            stage.processed += 1
+
+    def _emit(self, stage, next_stage, target, results):
+        for result in results:
+            if result is None:
+                continue
+            with stage.lock:
+                stage.emitted += 1
+            self._put(next_stage, target, result)
+
+    # Function to note a stage thread has stopped; the last one of a stage tells the next stage
+    def _stopped(self, index, remaining):
+        stage = self.stages[index]
+        with stage.lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last:
+            self._finish(index)
+
+    # Function to run the pipeline, yielding what the last stage emits as it is produced
+    def run(self):
+        self.started = time.perf_counter()
+        remaining = [stage.threads for stage in self.stages]
+        threads = [threading.Thread(target=self._produce, name=self.source_stage.name, daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.threads):
+                threads.append(threading.Thread(target=self._work_pool if stage.pool else self._work,
+                                                args=(index, remaining), name=f"{stage.name}-{n}", daemon=True))
+        for thread in threads:
+            thread.start()
+        while True:
+            item = self.outbox.get()
+            if item is _DONE:
+                break
+            yield item
+        for thread in threads:
+            thread.join()
+        self.finished = time.perf_counter()
+
+    # Function to get per-stage queue depth and throughput, usable while the pipeline runs
+    def stats(self):
+        if self.started is None:
+            return []
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        return [stage.stats(elapsed) for stage in [self.source_stage] + self.stages]
+
+    # Function to format the stage statistics as a small table
+    def format_stats(self):
+        lines = [f"{'stage':<10} {'workers':>7} {'queue':>7} {'max':>5} {'active':>6} {'done':>7} {'errors':>6} "
+                 f"{'items/s':>8} {'busy':>6}"]
+        for s in self.stats():
+            lines.append(f"{s['stage']:<10} {s['workers']:>7} {s['queue_depth']:>3}/{s['queue_size']:<3} "
+                         f"{s['max_queue_depth']:>5} {s['in_flight']:>6} {s['processed']:>7} {s['errors']:>6} "
+                         f"{s['items_per_second']:>8.1f} {s['utilization']:>6.0%}")
+        return "\n".join(lines)
+
+    # Function to print the stage statistics every interval seconds until the pipeline finishes
+    def monitor(self, interval):
+        def report():
+            while self.finished is None:
+                time.sleep(interval)
+                if self.finished is None:
+                    print(self.format_stats())
+        threading.Thread(target=report, daemon=True).start()
@@ -0,0 +1,187 @@
+import csv
+import hashlib
+import json
+import math
+import os
+import unicodedata
+from collections import namedtuple
+
+from bulkpost.quote_store import normalize
+
+FORMATS = ("txt", "csv", "jsonl")
+EXTENSIONS = {".txt": "txt", ".csv": "csv", ".tsv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+TAG_SEPARATORS = ",;|"
+
+# Sized for multi-million-line corpora: at most about 20 MB of bits for 5M quotes at 1 false positive
+# in 100k. Smaller files get a filter sized from their length, at one quote per MIN_QUOTE_BYTES
+# and never fewer than MIN_CAPACITY quotes (about 40 KB).
+DEFAULT_CAPACITY = 5_000_000
+DEFAULT_ERROR_RATE = 1e-5
+MIN_QUOTE_BYTES = 16
+MIN_CAPACITY = 10_000
+
+# One quote from a quote file; author and tags are empty for plain text files
+QuoteRecord = namedtuple("QuoteRecord", ["text", "author", "tags"])
+
+# Function to work out the false positive rate of a blocked Bloom filter holding capacity keys.
+# Keys do not spread evenly over the blocks, and the fuller blocks answer "seen" far more often
+# than a classic filter of the same size would, so the rate is averaged over the (Poisson)
+# number of keys per block.
+def blocked_error_rate(capacity, blocks, hashes, block_bits=512):
+    load = capacity / blocks
+    rate = 0.0
+    for keys in range(int(load + 12 * math.sqrt(load) + 12)):
+        share = math.exp(keys * math.log(load) - load - math.lgamma(keys + 1)) if load else float(keys == 0)
+        rate += share * (1 - (1 - 1 / block_bits) ** (hashes * keys)) ** hashes
+    return rate
+
+# Fixed-size set of seen keys. Memory does not grow with the number of quotes; in exchange,
+# about error_rate of new keys are wrongly reported as seen (and dropped as duplicates).
+# All bits of a key fall in one 64-byte block, so a lookup touches one cache line and the
+# bits are set with a single big-int mask instead of one Python operation per bit. That costs
+# about a third more bits than a classic filter for the same error rate.
+class BloomFilter:
+    BLOCK_BYTES = 64
+    BLOCK_BITS = 512
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE):
+        self.capacity = capacity = max(1, capacity)
+        size = -capacity * math.log(error_rate) / math.log(2) ** 2  # Bits a classic filter would need
+        while True:
+            self.blocks = max(1, math.ceil(size / self.BLOCK_BITS))
+            self.hashes = min(49, max(1, round(size / capacity * math.log(2))))  # 9 bits each from the digest
+            if blocked_error_rate(capacity, self.blocks, self.hashes, self.BLOCK_BITS) <= error_rate:
+                break
+            size *= 1.05
+        self.digest_size = 8 + math.ceil(self.hashes * 9 / 8)
+        self.bits = bytearray(self.blocks * self.BLOCK_BYTES)
+        self.count = 0
+
+    # Function to get the block offset and bit mask of a key
+    def _locate(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=self.digest_size).digest()
+        start = int.from_bytes(digest[:8], 'little') % self.blocks * self.BLOCK_BYTES
+        rest = int.from_bytes(digest[8:], 'little')
+        mask = 0
+        for _ in range(self.hashes):
+            mask |= 1 << (rest & 511)
+            rest >>= 9
+        return start, mask
+
+    # Function to add a key, returning False if it was (probably) there already
+    def add(self, key):
+        start, mask = self._locate(key)
+        block = int.from_bytes(self.bits[start:start + self.BLOCK_BYTES], 'little')
+        if block & mask == mask:
+            return False
+        self.bits[start:start + self.BLOCK_BYTES] = (block | mask).to_bytes(self.BLOCK_BYTES, 'little')
+        self.count += 1
+        if self.count == self.capacity + 1:
+            print(f"More than {self.capacity} unique quotes; duplicate detection is getting less exact")
+        return True
+
+    def __contains__(self, key):
+        start, mask = self._locate(key)
+        return int.from_bytes(self.bits[start:start + self.BLOCK_BYTES], 'little') & mask == mask
+
+# Function to clean up quote text: Unicode NFC, single spaces, no wrapping quote marks
+def clean_text(text):
+    text = ' '.join(unicodedata.normalize("NFC", text or '').split())
+    if len(text) > 1 and text[0] in '"“' and text[-1] in '"”':
+        text = text[1:-1].strip()
+    return text
+
+# Function to split a tags cell ("a, b; c") or JSON list into tags; anything else has no tags
+def parse_tags(value):
+    if not value or not isinstance(value, (str, list)):
+        return ()
+    if isinstance(value, str):
+        for separator in TAG_SEPARATORS[1:]:
+            value = value.replace(separator, TAG_SEPARATORS[0])
+        value = value.split(TAG_SEPARATORS[0])
+    return tuple(str(tag).strip().casefold() for tag in value if str(tag).strip())
+
+# Function to work out a quote file's format from its extension (plain text otherwise)
+def detect_format(path):
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower(), "txt")
+
+# Function to reject a quote file whose header (or first record) has no text column,
+# which would otherwise read as a file without any quotes
+def _check_column(path, text_column, columns, where):
+    if text_column not in columns:
+        raise ValueError(f"{path} has no '{text_column}' column in its {where}; "
+                         f"found {', '.join(map(repr, columns)) or 'none'}")
+
+# Function to read raw records from a quote file, one line or row at a time
+def _read_records(path, format, text_column, author_column, tags_column):
+    with open(path, 'r', encoding='utf-8', newline='' if format == "csv" else None) as f:
+        if format == "txt":
+            for line in f:
+                yield QuoteRecord(line, None, ())
+        elif format == "csv":
+            dialect = "excel-tab" if path.lower().endswith(".tsv") else "excel"
+            reader = csv.DictReader(f, dialect=dialect)
+            if reader.fieldnames is not None:  # None for an empty file
+                _check_column(path, text_column, reader.fieldnames, "header")
+            for row in reader:
+                yield QuoteRecord(row.get(text_column), row.get(author_column), parse_tags(row.get(tags_column)))
+        else:
+            checked = False
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    print(f"Skipping line {line_number} of {path}: {e}")
+                    continue
+                if not isinstance(row, dict):
+                    print(f"Skipping line {line_number} of {path}: expected an object, got {type(row).__name__}")
+                    continue
+                if not checked:
+                    _check_column(path, text_column, list(row), "first record")
+                    checked = True
+                text, author = row.get(text_column), row.get(author_column)
+                if text is not None and not isinstance(text, str):
+                    print(f"Skipping line {line_number} of {path}: '{text_column}' is not text ({type(text).__name__})")
+                    continue
+                yield QuoteRecord(text, author if isinstance(author, str) else None, parse_tags(row.get(tags_column)))
+
+# Function to stream cleaned quote records from a txt, CSV or JSONL file.
+# Quotes can be limited to some authors or tags, and repeats (ignoring case and spacing)
+# are dropped through a fixed-size Bloom filter, so memory stays flat however large the file.
+# The filter is sized from the file unless a capacity is given, and never holds more than
+# DEFAULT_CAPACITY quotes by default.
+def iter_records(path, format=None, text_column="quote", author_column="author", tags_column="tags",
+                 authors=None, tags=None, dedupe=True, capacity=None):
+    format = format or detect_format(path)
+    if format not in FORMATS:
+        raise ValueError(f"Unsupported quote file format '{format}', expected one of {', '.join(FORMATS)}")
+    authors = {normalize(author) for author in authors} if authors else None
+    tags = {tag.casefold() for tag in tags} if tags else None
+    if dedupe and capacity is None:
+        capacity = min(DEFAULT_CAPACITY, max(MIN_CAPACITY, os.path.getsize(path) // MIN_QUOTE_BYTES))
+    seen = BloomFilter(capacity) if dedupe else None
+    for record in _read_records(path, format, text_column, author_column, tags_column):
+        text = clean_text(record.text)
+        if not text:
+            continue
+        author = clean_text(record.author) or None
+        if authors is not None and normalize(author) not in authors:
+            continue
+        if tags is not None and not tags.intersection(record.tags):
+            continue
+        if seen is not None and not seen.add(normalize(text)):
+            continue
+        yield QuoteRecord(text, author, record.tags)
+
+# Function to format a record the way posts show it, with the author after the quote
+def format_quote(record):
+    if record.author and not normalize(record.text).endswith(normalize(record.author)):
+        return f"{record.text} - {record.author}"
+    return record.text
+
+# Function to stream the quotes of a file as post text
+def iter_quotes(path, **options):
+    for record in iter_records(path, **options):
+        yield format_quote(record)
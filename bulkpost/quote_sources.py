@@ -0,0 +1,238 @@
+import asyncio
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bulkpost import metrics
+from bulkpost.quote_store import normalize
+
+API_NINJAS_URL = 'https://api.api-ninjas.com/v1/quotes'
+FORISMATIC_URL = 'https://api.forismatic.com/api/1.0/'
+
+# Statuses worth retrying: rate limited or a temporary server failure
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RATE = 5.0  # requests per second
+DEFAULT_BURST = 5
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5  # seconds, doubled on every retry
+DEFAULT_TIMEOUT = 10
+
+# Serve quotes only from the local quote store, e.g. in CI without network access
+OFFLINE = os.environ.get("BULKPOST_OFFLINE") == "1"
+
+# Token bucket limiting how many requests start per second
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Quotes from API Ninjas for one author.
+# parse() returns (quote, author) pairs; lookup() serves the same query from a QuoteStore.
+class ApiNinjasSource:
+    name = "api_ninjas"
+    serve_from_store = True  # The same author query would pay for quotes we already have
+
+    def __init__(self, author, api_key, base_url=API_NINJAS_URL):
+        self.author = author
+        self.api_key = api_key
+        self.base_url = base_url
+
+    def request(self):
+        return self.base_url, {'author': self.author}, {'X-Api-Key': self.api_key}
+
+    def parse(self, response):
+        data = response.json()
+        if not data:
+            print("No quote returned in API response.")
+            return []
+        return [(f"{item['quote']} - {self.author}", self.author) for item in data]
+
+    def lookup(self, store, limit):
+        return store.by_author(self.author, limit)
+
+# Random quotes from Forismatic
+class ForismaticSource:
+    name = "forismatic"
+    serve_from_store = False  # Random quotes are only replayed from the store when offline
+
+    def __init__(self, base_url=FORISMATIC_URL, lang='en'):
+        self.base_url = base_url
+        self.lang = lang
+
+    def request(self):
+        return self.base_url, {'method': 'getQuote', 'format': 'json', 'lang': self.lang}, {}
+
+    def parse(self, response):
+        try:
+            data = response.json()
+        except ValueError:
+            # Forismatic sometimes escapes apostrophes, which is not valid JSON
+            data = json.loads(response.text.replace("\\'", "'"))
+        quote = data.get('quoteText', '').strip()
+        author = (data.get('quoteAuthor') or 'Unknown').strip()
+        if not quote:
+            return []
+        quote = re.sub(r'\\([^\n])', r'\\\\\1', quote)  # Escape backslashes
+        return [(f"{quote}\n- {author}", author)]
+
+    def lookup(self, store, limit):
+        return store.sample(limit, source=self.name)
+
+# Function to get the key used to spot repeated quotes
+def quote_key(quote):
+    return normalize(quote)
+
+# Function to create a pooled HTTP session sized for the given concurrency
+def make_session(concurrency=DEFAULT_CONCURRENCY):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# Function to get how long to wait before retrying a failed request
+def _retry_delay(response, attempt, backoff):
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return backoff * (2 ** attempt) * (1 + random.random() / 2)
+
+# Function to make one rate-limited request with retries, returning the parsed quotes
+async def _fetch_once(source, session, executor, bucket, retries, backoff, timeout):
+    loop = asyncio.get_running_loop()
+    url, params, headers = source.request()
+    for attempt in range(retries + 1):
+        await bucket.acquire()
+        response = None
+        started = time.perf_counter()
+        try:
+            response = await loop.run_in_executor(
+                executor, lambda: session.get(url, params=params, headers=headers, timeout=timeout))
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching quote from {source.name}: {e}")
+        # Request latency per source, including failed attempts
+        metrics.observe("bulkpost_fetch_seconds", time.perf_counter() - started, source=source.name)
+        metrics.count("bulkpost_fetch_requests_total", source=source.name,
+                      status=str(response.status_code) if response is not None else "error")
+        if response is not None and response.status_code == 200:
+            try:
+                return source.parse(response)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Malformed response from {source.name}: {e}")
+                return []
+        if response is not None and response.status_code not in RETRY_STATUSES:
+            print(f"Failed to fetch quote. HTTP {response.status_code}: {response.text}")
+            return []
+        if attempt < retries:
+            await asyncio.sleep(_retry_delay(response, attempt, backoff))
+    print(f"Giving up on a {source.name} request after {retries + 1} attempts")
+    return []
+
+# Function to fetch unique quotes concurrently, yielding each one as soon as it arrives.
+# Stops after num_quotes unique quotes or max_requests requests, whichever comes first.
+# With a store, every fetched quote is recorded, sources that allow it are served from the
+# store before going to the network, and offline mode never touches the network at all.
+async def stream_quotes(source, num_quotes, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE,
+                        burst=DEFAULT_BURST, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                        timeout=DEFAULT_TIMEOUT, max_requests=None, session=None, store=None,
+                        offline=None):
+    if offline is None:
+        offline = OFFLINE
+    seen = set()
+    if store is not None and (offline or source.serve_from_store):
+        for quote in source.lookup(store, num_quotes):
+            seen.add(quote_key(quote))
+            yield quote
+    elif offline:
+        print(f"Offline mode needs a quote store, no {source.name} quotes available")
+    if offline or len(seen) >= num_quotes:
+        return
+
+    if max_requests is None:
+        max_requests = num_quotes * 3  # Leave room for repeats
+    own_session = session is None
+    session = session or make_session(concurrency)
+    bucket = TokenBucket(rate, burst)
+    issued = 0
+    tasks = set()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            while len(seen) < num_quotes:
+                # Only keep as many requests in flight as quotes are still missing
+                while len(tasks) < min(concurrency, num_quotes - len(seen)) and issued < max_requests:
+                    tasks.add(asyncio.ensure_future(
+                        _fetch_once(source, session, executor, bucket, retries, backoff, timeout)))
+                    issued += 1
+                if not tasks:
+                    break
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for quote, author in task.result():
+                        if store is not None:
+                            store.add(quote, author, source.name)
+                        key = quote_key(quote)
+                        if key in seen or len(seen) >= num_quotes:
+                            continue
+                        seen.add(key)
+                        yield quote
+        finally:
+            for task in tasks:
+                task.cancel()
+            if own_session:
+                session.close()
+
+# Function to fetch num_quotes unique quotes and return them as a list
+def fetch_quotes(source, num_quotes, **options):
+    async def collect():
+        return [quote async for quote in stream_quotes(source, num_quotes, **options)]
+    return asyncio.run(collect())
+
+# Function to iterate over quotes from synchronous code while they are fetched in the background
+def iter_quotes(source, num_quotes, buffer_size=64, **options):
+    results = queue.Queue(maxsize=buffer_size)
+    done = object()
+
+    def run():
+        async def produce():
+            async for quote in stream_quotes(source, num_quotes, **options):
+                await asyncio.get_running_loop().run_in_executor(None, results.put, quote)
+        try:
+            asyncio.run(produce())
+        except Exception as e:
+            print(f"Error fetching quotes from {source.name}: {e}")
+        finally:
+            results.put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+    while True:
+        quote = results.get()
+        if quote is done:
+            return
+        yield quote
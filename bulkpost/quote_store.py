@@ -0,0 +1,96 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.path.join(".cache", "quotes.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS quotes (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    text TEXT NOT NULL,
+    author TEXT,
+    author_key TEXT,
+    source TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS quotes_author ON quotes (author_key);
+CREATE INDEX IF NOT EXISTS quotes_source ON quotes (source);
+"""
+
+# Function to normalize text so that case and spacing differences don't matter
+def normalize(text):
+    return ' '.join((text or '').split()).casefold()
+
+# Function to get the content hash a quote is stored under
+def content_hash(text):
+    return hashlib.sha1(normalize(text).encode('utf-8')).hexdigest()
+
+# Local SQLite store of every quote fetched, indexed by author and content hash
+class QuoteStore:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    # Function to record a quote, returning False if it was already stored
+    def add(self, text, author=None, source=None):
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO quotes (hash, text, author, author_key, source, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash(text), text, author, normalize(author) if author else None, source, time.time()))
+        return cursor.rowcount > 0
+
+    # Function to record several (text, author) pairs from one source
+    def add_many(self, quotes, source=None):
+        return sum(1 for text, author in quotes if self.add(text, author, source))
+
+    # Function to check whether a quote is already stored
+    def contains(self, text):
+        with self.lock:
+            row = self.db.execute("SELECT 1 FROM quotes WHERE hash = ?", (content_hash(text),)).fetchone()
+        return row is not None
+
+    # Function to get stored quotes by an author, oldest first
+    def by_author(self, author, limit=None):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT text FROM quotes WHERE author_key = ? ORDER BY id LIMIT ?",
+                (normalize(author), -1 if limit is None else limit)).fetchall()
+        return [row[0] for row in rows]
+
+    # Function to draw a random sample of stored quotes, optionally filtered by author or source
+    def sample(self, n, author=None, source=None):
+        query = "SELECT text FROM quotes"
+        conditions, params = [], []
+        if author:
+            conditions.append("author_key = ?")
+            params.append(normalize(author))
+        if source:
+            conditions.append("source = ?")
+            params.append(source)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY RANDOM() LIMIT ?"
+        with self.lock:
+            rows = self.db.execute(query, params + [n]).fetchall()
+        return [row[0] for row in rows]
+
+    # Function to count stored quotes, optionally for one author
+    def count(self, author=None):
+        with self.lock:
+            if author:
+                row = self.db.execute("SELECT COUNT(*) FROM quotes WHERE author_key = ?", (normalize(author),)).fetchone()
+            else:
+                row = self.db.execute("SELECT COUNT(*) FROM quotes").fetchone()
+        return row[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,108 @@
+import contextlib
+import os
+from collections import deque, namedtuple
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from bulkpost import metrics
+from bulkpost.memory import peak_rss
+
+# Outcome of one (background, quote) job; error is None when the render succeeded.
+# pid and peak_rss identify the process that ran it and its peak memory so far;
+# metrics holds what an instrumented worker process reported while running it.
+JobResult = namedtuple("JobResult", ["index", "job", "output", "error", "pid", "peak_rss", "metrics"],
+                       defaults=(None, None, None))
+
+# How many jobs each worker may have queued ahead of the one it is rendering
+JOBS_PER_WORKER = 4
+
+# Function to resolve the --workers value (0 or less means one per core)
+def resolve_workers(workers):
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+# Function to run a single job, turning any failure into a result instead of an exception
+def _run_job(build_fn, index, job):
+    try:
+        output, error = build_fn(*job), None
+    except Exception as e:
+        output, error = None, f"{type(e).__name__}: {e}"
+    return JobResult(index, job, output, error, os.getpid(), peak_rss(), metrics.drain())
+
+# Function to set up a worker process: instrumentation first, then the caller's initializer
+def _init_worker(instrumented, initializer, initargs):
+    metrics.init_worker(instrumented)
+    if initializer:
+        initializer(*initargs)
+
+# A pool of render processes. It can be kept across several render_jobs calls, so the
+# caches of its workers survive, and starts over with fresh processes if one of them dies.
+class RenderPool:
+    def __init__(self, workers, initializer=None, initargs=()):
+        self.workers = resolve_workers(workers)
+        self.generation = 0  # Bumped on every restart, so a breakage is only handled once
+        self._options = {"max_workers": self.workers, "initializer": _init_worker,
+                         "initargs": (metrics.enabled(), initializer, initargs)}
+        self._executor = ProcessPoolExecutor(**self._options)
+
+    # Function to queue a call, on a fresh pool if a worker of this one has died
+    def submit(self, fn, *args):
+        try:
+            return self._executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self.restart()
+            return self._executor.submit(fn, *args)
+
+    # Function to replace a broken pool; jobs that were queued on it are lost
+    def restart(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = ProcessPoolExecutor(**self._options)
+        self.generation += 1
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Function to render jobs with a pool of worker processes, or with pool when one is given.
+# Each job is a tuple of arguments for build_fn. Results are yielded in job order, and at most
+# max_pending jobs (default JOBS_PER_WORKER per worker) are in flight, so jobs can be a lazy generator.
+# A worker that dies fails the jobs queued at the time; the rest run on a fresh pool.
+def render_jobs(build_fn, jobs, workers=1, initializer=None, initargs=(), max_pending=None, pool=None):
+    workers = pool.workers if pool is not None else resolve_workers(workers)
+    if workers == 1:
+        if initializer:
+            initializer(*initargs)
+        for index, job in enumerate(jobs):
+            yield _run_job(build_fn, index, job)
+        return
+
+    max_pending = max(workers, max_pending or workers * JOBS_PER_WORKER)
+    with contextlib.ExitStack() as stack:
+        if pool is None:
+            pool = stack.enter_context(RenderPool(workers, initializer, initargs))
+        pending = deque()
+        for index, job in enumerate(jobs):
+            future = pool.submit(_run_job, build_fn, index, job)  # May restart the pool first
+            pending.append((index, job, pool.generation, future))
+            if len(pending) >= max_pending:
+                yield _collect(pool, *pending.popleft())
+        while pending:
+            yield _collect(pool, *pending.popleft())
+
+# Function to wait for a job and pass on what its worker process reported, then hand back its result.
+# A job lost with its worker (killed for memory, crashed in native code) comes back failed.
+def _collect(pool, index, job, generation, future):
+    try:
+        result = future.result()
+    except (BrokenProcessPool, CancelledError) as e:
+        if generation == pool.generation:
+            pool.restart()
+        return JobResult(index, job, None, f"{type(e).__name__}: {e or 'worker process died'}")
+    metrics.replay(result.metrics)
+    return result
@@ -0,0 +1,262 @@
+import json
+import os
+import socket
+import time
+
+from bulkpost.jobs import (load_inputs, iter_posts, new_summary, render_posts, finish_summary, post_outputs,
+                           memory_plan, open_pool)
+from bulkpost.manifest import BuildManifest, MANIFEST_NAME, post_file_name
+from bulkpost.render_engine import resolve_workers
+
+PLAN_NAME = "plan.json"
+QUEUE_NAME = "queue"
+SHARD_PREFIX = "shard-"
+DEFAULT_CHUNK_SIZE = 500
+HEARTBEAT_EVERY = 10.0  # Seconds between refreshes of a claim while its chunk renders
+DEFAULT_REQUEUE_AFTER = 600  # Seconds before a claimed chunk is assumed lost with its worker
+
+# Function to parse a "--shard i/N" value into a 1-based index and a shard count
+def parse_shard(text):
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"shard must look like i/N, got {text!r}")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"shard index must be between 1 and {count}, got {text!r}")
+    return index, count
+
+# Function to tell whether a post belongs to a shard. Posts are assigned by their digest,
+# so the split is the same on every node whatever order the inputs are listed in.
+def in_shard(digest, index, count):
+    return int(digest[:16], 16) % count == index - 1
+
+# Function to get the output directory of one shard or queue worker
+def shard_dir(out_dir, name):
+    return os.path.join(out_dir, f"{SHARD_PREFIX}{name}")
+
+# Function to list the shard directories under an output directory
+def shard_dirs(out_dir):
+    if not os.path.isdir(out_dir):
+        return []
+    return [os.path.join(out_dir, name) for name in sorted(os.listdir(out_dir))
+            if name.startswith(SHARD_PREFIX) and os.path.exists(os.path.join(out_dir, name, MANIFEST_NAME))]
+
+def plan_path(job):
+    return os.path.join(job.output["dir"], PLAN_NAME)
+
+# Function to list every post of a job once, with the file name it will get
+def build_plan(job):
+    im_paths, quotes = load_inputs(job)
+    ext = job.format().ext
+    posts = {}
+    for digest, im_path, quote in iter_posts(job, im_paths, quotes):
+        posts.setdefault(digest, [digest, im_path, quote, post_file_name(quote, digest, ext)])
+    return {"job": job.config, "posts": list(posts.values())}
+
+# Function to write the plan shared by all nodes next to the final output
+def save_plan(job, plan):
+    path = plan_path(job)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(plan, f)
+    os.replace(tmp_path, path)
+    return path
+
+# Function to tell whether every node would build the same plan for a job on its own:
+# quotes from a file, paired in order or with a fixed seed
+def is_deterministic(job):
+    return job.source["type"] == "file" and (job.pairing in ("all", "one_to_one") or job.seed is not None)
+
+# Function to load a job's plan. Nodes started together may all build a deterministic plan
+# on demand (they write the same file atomically); any other plan must be made once with `bulkpost plan`.
+def load_plan(job):
+    try:
+        with open(plan_path(job), 'r', encoding='utf-8') as f:
+            plan = json.load(f)
+    except FileNotFoundError:
+        if not is_deterministic(job):
+            reason = ("quotes come from an API" if job.source["type"] != "file"
+                      else f"{job.pairing} pairing without a seed differs per node")
+            raise ValueError(f"No plan at {plan_path(job)} and {reason}; "
+                             "run `python -m bulkpost plan` once before the shards")
+        plan = build_plan(job)
+        save_plan(job, plan)
+        return plan
+    if plan["job"] != job.config:
+        raise ValueError(f"{plan_path(job)} was made for a different job file; run `python -m bulkpost plan` again")
+    return plan
+
+# Function to tell whether every output of a post is already merged into the final output
+def is_merged(job, merged, digest):
+    return all(merged.is_fresh(output_digest) for _, output_digest in post_outputs(job, digest))
+
+# Function to render the slice of a job that belongs to shard index of count into its own directory
+def run_shard(job, index, count, workers=None, force=False):
+    started = time.perf_counter()
+    workers = resolve_workers(job.workers if workers is None else workers)
+    plan = load_plan(job)
+    merged = BuildManifest(job.output["dir"])
+    manifest = BuildManifest(shard_dir(job.output["dir"], f"{index}-of-{count}"))
+    summary = new_summary(job, manifest.out_dir, shard=f"{index}/{count}", planned=0)
+    posts = []
+    for digest, im_path, quote, _ in plan["posts"]:
+        if in_shard(digest, index, count):
+            summary["planned"] += 1
+            if force or not is_merged(job, merged, digest):
+                posts.append((digest, im_path, quote))
+    summary["skipped"] += (summary["planned"] - len(posts)) * max(1, len(job.variants))
+    render_posts(job, posts, manifest, summary, workers, force, total=summary["planned"] * max(1, len(job.variants)))
+    return finish_summary(summary, started, workers)
+
+# Function to move finished posts from the shard directories into the output directory
+# and check that every post in the plan is there
+def merge_shards(job):
+    out_dir = job.output["dir"]
+    plan = load_plan(job)
+    manifest = BuildManifest(out_dir)
+    shards = [BuildManifest(path) for path in shard_dirs(out_dir)]
+    summary = {"job": job.name, "output_dir": out_dir, "shards": len(shards),
+               "planned": len(plan["posts"]) * max(1, len(job.variants)), "merged": 0, "present": 0, "missing": []}
+    for post_digest, im_path, quote, _ in plan["posts"]:
+        for variant, digest in post_outputs(job, post_digest):
+            if manifest.is_fresh(digest):
+                summary["present"] += 1
+                continue
+            for shard in shards:
+                if shard.is_fresh(digest):
+                    entry = shard.entries.pop(digest)
+                    path = os.path.join(out_dir, entry["file"])
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(os.path.join(shard.out_dir, entry["file"]), path)
+                    manifest.record(digest, entry["file"], entry["image"], entry["quote"])
+                    summary["merged"] += 1
+                    break
+            else:
+                missing = {"digest": digest, "image": im_path, "quote": quote}
+                if variant is not None:
+                    missing["variant"] = variant.name
+                summary["missing"].append(missing)
+    manifest.save()
+    for shard in shards:
+        shard.save()
+    summary["complete"] = not summary["missing"]
+    return summary
+
+# Work queue on a shared filesystem. A job's plan is split into chunk files under pending/;
+# a worker claims one by renaming it into claimed/ (atomic, so exactly one worker wins) and
+# moves it to done/ when finished. Workers refresh the claim's mtime as posts complete; chunks
+# not refreshed for too long (the worker died or hung) go back to pending/.
+class WorkQueue:
+    def __init__(self, path):
+        self.path = path
+        self.dirs = {state: os.path.join(path, state) for state in ("pending", "claimed", "done")}
+        self.last_heartbeat = 0.0
+        for dir_path in self.dirs.values():
+            os.makedirs(dir_path, exist_ok=True)
+
+    # Function to split posts into chunk files; a queue is only filled once
+    def fill(self, posts, chunk_size=DEFAULT_CHUNK_SIZE):
+        if any(self.counts().values()):
+            raise ValueError(f"work queue {self.path} is already filled")
+        chunks = 0
+        for start in range(0, len(posts), chunk_size):
+            name = f"chunk-{chunks:06d}.json"
+            tmp_path = os.path.join(self.path, f"{name}.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(posts[start:start + chunk_size], f)
+            os.replace(tmp_path, os.path.join(self.dirs["pending"], name))
+            chunks += 1
+        return chunks
+
+    # Function to claim the next pending chunk, returning (name, posts) or None when none is left
+    def claim(self):
+        for name in sorted(os.listdir(self.dirs["pending"])):
+            claimed = os.path.join(self.dirs["claimed"], name)
+            try:
+                os.rename(os.path.join(self.dirs["pending"], name), claimed)
+            except FileNotFoundError:
+                continue  # Another worker got it first
+            try:
+                os.utime(claimed)  # Claim time, for requeue_stale()
+                self.last_heartbeat = time.time()
+                with open(claimed, 'r', encoding='utf-8') as f:
+                    return name, json.load(f)
+            except FileNotFoundError:
+                continue  # Requeued by another worker in between; it will come round again
+        return None
+
+    # Function to show a claimed chunk is still being worked on, at most every HEARTBEAT_EVERY seconds
+    def heartbeat(self, name):
+        now = time.time()
+        if now - self.last_heartbeat < HEARTBEAT_EVERY:
+            return
+        self.last_heartbeat = now
+        try:
+            os.utime(os.path.join(self.dirs["claimed"], name))
+        except FileNotFoundError:
+            pass  # Already requeued; complete() still records the work
+
+    # Function to mark a chunk as done, even if it was requeued while this worker was on it
+    def complete(self, name):
+        for state in ("claimed", "pending"):
+            try:
+                os.replace(os.path.join(self.dirs[state], name), os.path.join(self.dirs["done"], name))
+                return
+            except FileNotFoundError:
+                continue
+
+    # Function to put chunks whose worker has not finished them in time back in the queue
+    def requeue_stale(self, timeout=DEFAULT_REQUEUE_AFTER):
+        requeued = 0
+        for name in os.listdir(self.dirs["claimed"]):
+            path = os.path.join(self.dirs["claimed"], name)
+            try:
+                if time.time() - os.path.getmtime(path) > timeout:
+                    os.rename(path, os.path.join(self.dirs["pending"], name))
+                    requeued += 1
+            except FileNotFoundError:
+                pass
+        return requeued
+
+    def counts(self):
+        return {state: len(os.listdir(dir_path)) for state, dir_path in self.dirs.items()}
+
+def queue_path(job):
+    return os.path.join(job.output["dir"], QUEUE_NAME)
+
+# Function to fill a job's work queue from its plan
+def fill_queue(job, chunk_size=DEFAULT_CHUNK_SIZE):
+    plan = load_plan(job)
+    queue = WorkQueue(queue_path(job))
+    chunks = queue.fill(plan["posts"], chunk_size)
+    return {"job": job.name, "queue": queue.path, "posts": len(plan["posts"]), "chunks": chunks}
+
+# Function to take chunks from a job's work queue and render them until it is empty.
+# The render processes are started once, so their background caches carry over between chunks.
+def run_worker(job, name=None, workers=None, force=False, requeue_after=DEFAULT_REQUEUE_AFTER):
+    started = time.perf_counter()
+    workers = resolve_workers(job.workers if workers is None else workers)
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    queue = WorkQueue(queue_path(job))
+    merged = BuildManifest(job.output["dir"])
+    manifest = BuildManifest(shard_dir(job.output["dir"], name))
+    summary = new_summary(job, manifest.out_dir, worker=name, chunks=0)
+    plan = memory_plan(job, workers)
+    with open_pool(plan) as pool:
+        while True:
+            queue.requeue_stale(requeue_after)
+            claimed = queue.claim()
+            if claimed is None:
+                break
+            chunk, posts = claimed
+            print(f"Worker {name} rendering {chunk} ({len(posts)} posts)")
+            todo = [(digest, im_path, quote) for digest, im_path, quote, _ in posts
+                    if force or not is_merged(job, merged, digest)]
+            summary["skipped"] += (len(posts) - len(todo)) * max(1, len(job.variants))
+            render_posts(job, todo, manifest, summary, workers, force, on_result=lambda: queue.heartbeat(chunk),
+                         plan=plan, pool=pool)
+            queue.complete(chunk)
+            summary["chunks"] += 1
+    summary["queue"] = queue.counts()
+    return finish_summary(summary, started, workers)
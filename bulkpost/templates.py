@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+
+from PIL import Image, ImageDraw
+
+from bulkpost import layout, metrics
+from bulkpost.assets import get_font, get_logo, get_logo_size, text_size
+from bulkpost.backgrounds import get_background
+from bulkpost.manifest import file_digest
+
+DEFAULT_TEMPLATE = os.path.join("templates", "default.json")
+
+_templates = {}
+_overlays = {}
+stats = {"hits": 0, "misses": 0}
+
+# A brand layout loaded from a JSON file: background treatment, quote style and static layers.
+#
+# Layers are drawn once into a transparent overlay. "text" and "image" layers with
+# "position": "bottom" are stacked upwards from the bottom edge in file order, each "margin"
+# pixels above the previous one; other layers are centered on fractional "x"/"y" coordinates.
+# "frame" draws a border "width" pixels wide, "inset" pixels from the edge. A layer with a
+# "role" (e.g. "trademark", "logo") can be switched off per run.
+class Template:
+    def __init__(self, config, path=None):
+        self.path = path
+        self.name = config.get("name", os.path.splitext(os.path.basename(path or "template"))[0])
+        self.size = tuple(config.get("size", (1080, 1080)))
+        self.background = dict(config.get("background", {}))
+        self.quote = dict(config.get("quote", {}))
+        self.quote.setdefault("font", "utils/BebasNeue.otf")
+        self.layers = list(config.get("layers", []))
+        self.config = config
+
+    # Function to get the roles that can be switched off
+    @property
+    def roles(self):
+        return {layer["role"] for layer in self.layers if "role" in layer}
+
+    # Function to hash the template together with every font and image it uses
+    def digest(self):
+        h = hashlib.sha256(json.dumps(self.config, sort_keys=True).encode('utf-8'))
+        files = [self.quote["font"]] + [layer.get("font") or layer.get("path") for layer in self.layers]
+        for path in files:
+            if path:
+                h.update(file_digest(path).encode('ascii'))
+        return h.hexdigest()
+
+# Function to get the layer roles to leave out from the usual logo/trademark questions
+def disabled_roles(logo=True, trademark=True):
+    return frozenset(role for role, wanted in (("logo", logo), ("trademark", trademark)) if not wanted)
+
+# Function to load a template file, re-reading it only when it changes
+def load_template(path=DEFAULT_TEMPLATE):
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    template = _templates.get(key)
+    if template is None:
+        with open(path, 'r', encoding='utf-8') as f:
+            template = _templates[key] = Template(json.load(f), path)
+    return template
+
+# Function to get the (width, height) of a layer, and the image to paste for image layers
+def _measure_layer(layer, W):
+    if layer["type"] == "text":
+        font = get_font(layer["font"], layer["size"])
+        return text_size(layer["text"], font), None
+    logo_w, logo_h = get_logo_size(layer["path"])
+    width = int(W * layer.get("width", 0.2))
+    logo, mask = get_logo(layer["path"], (width, int(logo_h * width / logo_w)))
+    if layer.get("opacity", 1) < 1:
+        logo = logo.copy()  # The cached logo is shared with other templates
+        logo.putalpha(mask.point(lambda a: round(a * layer["opacity"])))
+    return logo.size, logo
+
+# Function to draw one text or image layer onto the overlay
+def _draw_layer(overlay, layer, position, image):
+    if layer["type"] == "text":
+        fill = layer.get("fill", "white")
+        fill = tuple(fill) if isinstance(fill, list) else fill
+        ImageDraw.Draw(overlay).text(position, layer["text"], font=get_font(layer["font"], layer["size"]), fill=fill)
+    else:
+        # Compositing keeps the logo's alpha as is; pasting with it as the mask would square it
+        x, y = position
+        overlay.alpha_composite(image, (max(x, 0), max(y, 0)), (max(-x, 0), max(-y, 0)))
+
+# Function to draw every enabled static layer into a transparent RGBA image
+def render_overlay(template, size=None, disabled=()):
+    W, H = size or template.size
+    overlay = Image.new('RGBA', (W, H), (0, 0, 0, 0))
+    bottom = H
+    for layer in template.layers:
+        if layer.get("role") in disabled:
+            continue
+        if layer["type"] == "frame":
+            inset, width = layer.get("inset", 0), layer.get("width", 10)
+            ImageDraw.Draw(overlay).rectangle((inset, inset, W - 1 - inset, H - 1 - inset),
+                                              outline=tuple(layer.get("fill", (255, 255, 255, 255))), width=width)
+            continue
+        (w, h), image = _measure_layer(layer, W)
+        if layer.get("position") == "bottom":
+            y = bottom - h - layer.get("margin", 0)
+            bottom = y
+            x = (W - w) / 2 if layer["type"] == "text" else (W - w) // 2
+        else:
+            x, y = int(W * layer.get("x", 0.5) - w / 2), int(H * layer.get("y", 0.5) - h / 2)
+        _draw_layer(overlay, layer, (x, y) if layer["type"] == "text" else (int(x), int(y)), image)
+    return overlay
+
+# Function to get the cached overlay for a template, cropped to the area it actually covers
+def get_overlay(template, size=None, disabled=()):
+    key = (template.path, id(template), tuple(size or template.size), frozenset(disabled))
+    entry = _overlays.get(key)
+    if entry is None:
+        stats["misses"] += 1
+        overlay = render_overlay(template, size, disabled)
+        bbox = overlay.getchannel('A').getbbox()
+        entry = _overlays[key] = (overlay.crop(bbox), bbox[:2]) if bbox else (None, None)
+    else:
+        stats["hits"] += 1
+    return entry
+
+# Function to composite the cached overlay onto a post in one pass over the covered area
+def apply_overlay(im, template, disabled=()):
+    overlay, offset = get_overlay(template, im.size, disabled)
+    if overlay is not None:
+        im.paste(overlay, offset, overlay)
+    return im
+
+# Function to get the background treatment of a template as backgrounds keyword arguments
+def background_options(template):
+    bg = template.background
+    return {"tint_color": tuple(bg.get("tint", (200, 200, 200))), "brightness": bg.get("brightness", 0.6),
+            "gradient": bg.get("gradient"), "vignette": bg.get("vignette", 0.0), "fit": bg.get("fit", "crop")}
+
+# Function to draw the quote and the static overlay of a template onto a prepared background
+def draw_post(im, quote, template, disabled=()):
+    q = template.quote
+    with metrics.timed("bulkpost_render_seconds"):
+        quote_layout = layout.layout_quote(quote, q["font"], im.size, q.get("max_size", 115),
+                                           q.get("min_size", layout.MIN_FONT_SIZE))
+        layout.draw_layout(im, quote_layout, q.get("fill", "white"))
+        return apply_overlay(im, template, disabled)
+
+# Function to render a post from a template: background, quote, then the static overlay.
+# With out (see memory.get_frame), the post is drawn into that reused canvas.
+def render_post(im_path, quote, template, disabled=(), cache_dir=None, out=None):
+    im = get_background(im_path, template.size, cache_dir=cache_dir, out=out, **background_options(template))
+    return draw_post(im, quote, template, disabled)
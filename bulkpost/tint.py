@@ -0,0 +1,56 @@
+from PIL import Image, ImageChops, ImageEnhance
+
+DEFAULT_TINT = (200, 200, 200)
+DEFAULT_BRIGHTNESS = 0.6
+
+_luts = {}
+_overlays = {}
+
+# Function to apply a tint the original way: a full-frame multiply followed by a brightness pass
+def reference_tint(im, tint_color=DEFAULT_TINT, brightness=DEFAULT_BRIGHTNESS):
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+    tinted_im = ImageChops.multiply(im, Image.new('RGB', im.size, tint_color))
+    return ImageEnhance.Brightness(tinted_im).enhance(brightness)
+
+# Function to get the per-channel lookup table equivalent to reference_tint.
+# The table is computed by running reference_tint on every channel value once,
+# so rounding matches Pillow's multiply and blend exactly.
+def tint_lut(tint_color=DEFAULT_TINT, brightness=DEFAULT_BRIGHTNESS):
+    key = (tuple(tint_color), brightness)
+    lut = _luts.get(key)
+    if lut is None:
+        ramp = Image.new('RGB', (256, 1))
+        ramp.putdata([(i, i, i) for i in range(256)])
+        tinted = reference_tint(ramp, tint_color, brightness)
+        lut = _luts[key] = [value for band in tinted.split() for value in band.getdata()]
+    return lut
+
+# Function to get a cached RGB multiply mask for a gradient and/or vignette at a given size
+def overlay_mask(size, gradient=None, vignette=0.0):
+    key = (tuple(size), tuple(map(tuple, gradient)) if gradient else None, vignette)
+    mask = _overlays.get(key)
+    if mask is None:
+        mask = Image.new('RGB', (256, 256), (255, 255, 255))
+        if gradient:
+            top, bottom = gradient
+            ramp = Image.linear_gradient('L')  # 0 at the top, 255 at the bottom
+            bands = [ramp.point(lambda v, a=a, b=b: round(a + (b - a) * v / 255)) for a, b in zip(top, bottom)]
+            mask = Image.merge('RGB', bands)
+        if vignette:
+            # radial_gradient is 0 in the middle and 255 at the edges
+            falloff = Image.radial_gradient('L').point(lambda v: round(255 - min(255, v) * vignette))
+            mask = ImageChops.multiply(mask, Image.merge('RGB', [falloff] * 3))
+        mask = _overlays[key] = mask.resize(tuple(size), Image.Resampling.BILINEAR)
+    return mask
+
+# Function to apply a tint color and brightness to the image in a single lookup-table pass.
+# Gives the same pixels as reference_tint; an optional gradient ((top RGB), (bottom RGB))
+# and vignette strength (0-1) are applied with one extra multiply by a cached mask.
+def apply_tint(im, tint_color=DEFAULT_TINT, brightness=DEFAULT_BRIGHTNESS, gradient=None, vignette=0.0):
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+    tinted_im = im.point(tint_lut(tint_color, brightness))
+    if gradient or vignette:
+        tinted_im = ImageChops.multiply(tinted_im, overlay_mask(im.size, gradient, vignette))
+    return tinted_im
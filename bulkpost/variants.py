@@ -0,0 +1,111 @@
+import copy
+import hashlib
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from bulkpost import backgrounds, layout, memory, templates
+from bulkpost.manifest import post_file_name
+
+# Output sizes a job can ask for by name; anything else is given as {"name": ..., "size": [w, h]}
+PRESETS = {
+    "square": (1080, 1080),
+    "portrait": (1080, 1350),
+    "story": (1080, 1920),
+    "twitter": (1200, 675),
+    "landscape": (1920, 1080),
+}
+ENCODE_THREADS = 4  # Variants of one post drawn and encoded at the same time; Pillow encodes without the GIL
+
+# One output canvas of a post; its files go to a subdirectory named after it
+Variant = namedtuple("Variant", ["name", "size"])
+
+_scaled = {}
+_pool = None
+
+# Function to read a job's "variants" list: preset names or {"name", "size"} mappings
+def parse_variants(spec):
+    variants = []
+    for item in spec or ():
+        if isinstance(item, str):
+            if item not in PRESETS:
+                raise ValueError(f"Unknown variant {item!r}, expected one of {', '.join(PRESETS)} or a name and size")
+            variant = Variant(item, PRESETS[item])
+        elif isinstance(item, dict) and item.get("name") and len(item.get("size") or ()) == 2:
+            variant = Variant(str(item["name"]), tuple(int(n) for n in item["size"]))
+        else:
+            raise ValueError(f"A variant must be a preset name or {{\"name\": ..., \"size\": [w, h]}}, got {item!r}")
+        if min(variant.size) <= 0:
+            raise ValueError(f"Variant {variant.name} must have a positive size")
+        if variant.name in (v.name for v in variants):
+            raise ValueError(f"Variant {variant.name} is listed twice")
+        variants.append(variant)
+    return variants
+
+# Function to content-address one variant of a post from the post digest (None is the post itself)
+def variant_digest(digest, variant):
+    if variant is None:
+        return digest
+    key = f"{digest}:{variant.name}:{variant.size[0]}x{variant.size[1]}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+# Function to get the output path of a variant, relative to the output directory
+def variant_file_name(quote, digest, variant, ext="png"):
+    file_name = post_file_name(quote, digest, ext)
+    return file_name if variant is None else os.path.join(variant.name, file_name)
+
+# Function to adapt a template to another canvas size.
+# Pixel sizes (fonts, margins, frame, logo width) follow the shorter scale so the overlay keeps its
+# proportions on wide and tall canvases. Image layer widths are a share of the canvas width, so they
+# are converted to keep the logo at width * shorter scale pixels (216 px on square, 135 px on twitter).
+def scale_template(template, size):
+    size = tuple(size)
+    if size == template.size:
+        return template
+    key = (id(template), size)
+    entry = _scaled.get(key)
+    if entry is None:
+        scale = min(size[0] / template.size[0], size[1] / template.size[1])
+        config = copy.deepcopy(template.config)
+        config["size"] = list(size)
+        quote = config.setdefault("quote", {})
+        quote["max_size"] = max(1, round(quote.get("max_size", 115) * scale))
+        quote["min_size"] = min(quote["max_size"], max(1, round(quote.get("min_size", layout.MIN_FONT_SIZE) * scale)))
+        for layer in config.get("layers", []):
+            if layer["type"] == "image":
+                layer["width"] = layer.get("width", 0.2) * template.size[0] * scale / size[0]
+            elif layer["type"] == "frame":
+                layer["width"] = max(1, round(layer.get("width", 10) * scale))
+                layer["inset"] = round(layer.get("inset", 0) * scale)
+            else:
+                layer["size"] = max(1, round(layer["size"] * scale))
+            if "margin" in layer:
+                layer["margin"] = round(layer["margin"] * scale)
+        # Keep the original alive so its id cannot be reused by another template
+        entry = _scaled[key] = (template, templates.Template(config, template.path))
+    return entry[1]
+
+# Function to get this process's variant thread pool, created on first use (after any fork)
+def _executor():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=ENCODE_THREADS, thread_name_prefix="variant")
+    return _pool
+
+# Function to draw and encode one variant onto its prepared background
+def _encode_variant(variant, im, quote, template, disabled, fmt):
+    frame = memory.get_variant_frame(variant.name, variant.size)
+    frame.paste(im, (0, 0))
+    return fmt.encode(templates.draw_post(frame, quote, scale_template(template, variant.size), disabled))
+
+# Function to render and encode several variants of one post.
+# The background is decoded once for all of them; each variant is then resized, laid out and
+# encoded on its own canvas, in parallel. Returns the encoded bytes in variant order.
+def render_variants(im_path, quote, template, variants, fmt, disabled=(), cache_dir=None):
+    prepared = backgrounds.prepare_backgrounds(im_path, [variant.size for variant in variants], cache_dir=cache_dir,
+                                               **templates.background_options(template))
+    if len(variants) == 1:
+        return [_encode_variant(variants[0], prepared[0], quote, template, disabled, fmt)]
+    futures = [_executor().submit(_encode_variant, variant, im, quote, template, disabled, fmt)
+               for variant, im in zip(variants, prepared)]
+    return [future.result() for future in futures]
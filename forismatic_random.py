@@ -1,138 +1,73 @@
 import os
-import requests
-from PIL import Image, ImageDraw, ImageFont, ImageChops, ImageEnhance
-import textwrap
-import time  # Import time module for delay
-
-import re
-
-# Function to fetch a random quote from Forismatic API
-def get_random_quote():
-    try:
-        response = requests.get(
-            'https://api.forismatic.com/api/1.0/?method=getQuote&format=json&lang=en'
-        )
-        if response.status_code == 200:
-            data = response.json()
-            quote = data.get('quoteText', '').strip()
-            author = data.get('quoteAuthor', 'Unknown').strip()
-
-            # Sanitize the quote text by escaping problematic characters
-            if quote:
-                quote = re.sub(r'\\([^\n])', r'\\\\\1', quote)  # Escape backslashes
-                return f"{quote}\n- {author}" if quote else None
-            else:
-                return None
-        else:
-            print(f"Failed to fetch quote. Status code: {response.status_code}")
-            return None
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching quote from API: {e}")
-        return None
-
-# Function to get paths of image files from a directory
-def get_im_paths(dir_path):
-    return [file for file in os.listdir(dir_path) if is_img(file)]
-
-# Function to check if a file path is an image
-def is_img(file_name):
-    ext = os.path.splitext(file_name)[1].lower()
-    return ext in ['.jpg', '.jpeg', '.png']
-
-# Function to apply a tint color to the image
-def apply_tint(im, tint_color):
-    # Ensure the image is in 'RGB' mode to avoid mode mismatch
-    if im.mode != 'RGB':
-        im = im.convert('RGB')
-    
-    # Create a new tint image with the same size as the background image
-    tint_image = Image.new('RGB', im.size, tint_color)
-    
-    # Apply the tint
-    tinted_im = ImageChops.multiply(im, tint_image)
-    
-    # Enhance the brightness of the tinted image
-    tinted_im = ImageEnhance.Brightness(tinted_im).enhance(0.6)
-    
-    return tinted_im
-
-# Function to place a logo at the bottom of the image
-def place_logo(bkg, logo, trademark, font):
-    bkg_width, bkg_height = bkg.size
-    logo_width, logo_height = logo.size
-    draw = ImageDraw.Draw(bkg)
-    text_width, text_height = draw.textbbox((0, 0), trademark, font=font)[2:]
-    spacing = 10  # Increase spacing to give room for the logo
-    
-    # Resize the logo to a smaller size (e.g., 15% of the image width)
-    logo_size = int(bkg_width * 0.2)  # 20% of the background image width
-    logo = logo.resize((logo_size, int(logo.size[1] * logo_size / logo.size[0])), Image.Resampling.LANCZOS)
-    logo_width, logo_height = logo.size
-    
-    # Center the logo horizontally and place it near the bottom with extra space for the trademark
-    x_position = int((bkg_width - logo_width) / 2)
-    y_position = bkg_height - logo_height - text_height - spacing  # Place it above the trademark
-
-    # Ensure logo has an alpha channel for transparency handling
-    logo = logo.convert("RGBA")
-    bkg.paste(logo, (x_position, y_position), logo)  # Use logo as the mask for transparency
-    return bkg
-
-
-# Function to place a trademark text at the bottom of the image
-def place_trademark(im, trademark, font):
-    draw = ImageDraw.Draw(im)
-    W, H = im.size
-    text_width, text_height = draw.textbbox((0, 0), trademark, font=font)[2:]
-    x = (W - text_width) / 2
-    y = H - text_height - 10  # 10 pixels from the bottom
-    draw.text((x, y), trademark, font=font, fill="white")
-    return im
-
-# Function to place the quote in the center of the image
-def place_quote(im, quote, font):
-    draw = ImageDraw.Draw(im)
-    W, H = im.size
-    lines = textwrap.wrap(quote, width=24)
-    n_lines = len(lines)
-    pad = -10
-    current_h = H / 2 - (n_lines * draw.textbbox((0, 0), lines[0], font=font)[3] / 2)
-    for line in lines:
-        text_width, text_height = draw.textbbox((0, 0), line, font=font)[2:]
-        draw.text(((W - text_width) / 2, current_h), line, font=font, fill="white")
-        current_h += text_height + pad
-
-# Function to build and save the image
-def build_image(im_path, quote, im_count='', include_trademark=False, include_logo=False):
-    W = H = 1080
-    im = Image.open(os.path.join("in", "raw", im_path)).resize((W, H))
-    im = apply_tint(im, (200, 200, 200))
-    draw = ImageDraw.Draw(im)
-    cap_font = ImageFont.truetype("utils/BebasNeue.otf", 115)
-    place_quote(im, quote, cap_font)
-    
-    if include_trademark:
-        trademark = "YOUR_TRADEMARK"
-        tm_font = ImageFont.truetype("utils/BebasNeue.otf", 52)
-        place_trademark(im, trademark, tm_font)
-    
-    if include_logo:
-        try:
-            logo = Image.open("shelby.png")  # Replace with actual path to logo file
-            place_logo(im, logo, trademark, tm_font)
-        except Exception as e:
-            print(f"Error loading logo: {e}")
-
-    if not os.path.exists("out"):
-        os.makedirs("out")
-    
-    file_name = f"{im_count}_{quote[:10].replace(' ', '_')}.png"
-    im.save(f'out/{file_name}')
+import argparse
+from bulkpost import templates
+from bulkpost.backgrounds import CACHE_DIR, DISK_CACHE_MB, add_disk_cache_arguments, prune_disk_cache
+from bulkpost.discovery import find_images
+from bulkpost.pairing import curate
+from bulkpost.render_engine import resolve_workers
+from bulkpost.pipeline import Pipeline
+from bulkpost import metrics
+from bulkpost.quote_sources import ForismaticSource, iter_quotes
+from bulkpost.quote_store import QuoteStore
+from bulkpost.encoders import OutputFormat, add_format_arguments, format_from_args, write_file
+from bulkpost.assets import format_stats
+from bulkpost.jobs import RENDER_VERSION
+from bulkpost.manifest import post_digest, post_file_name
+from bulkpost.templates import DEFAULT_TEMPLATE, load_template, disabled_roles
+
+# Function to get paths of image files relative to a directory, checked from their headers.
+# Near-duplicates and backgrounds the quote would be hard to read on are left out.
+def get_im_paths(dir_path, template_path=DEFAULT_TEMPLATE):
+    im_paths, _ = curate(find_images(dir_path), load_template(template_path))
+    return [os.path.relpath(path, dir_path) for path in im_paths]
+
+# Function to render one post in memory from a template (background, quote, cached static overlay)
+def render_post(im_path, quote, include_trademark=False, include_logo=False, template_path=DEFAULT_TEMPLATE,
+                cache_dir=CACHE_DIR):
+    template = load_template(template_path)
+    disabled = disabled_roles(include_logo, include_trademark)
+    return templates.render_post(os.path.join("in", "raw", im_path), quote, template, disabled, cache_dir)
+
+# Function to name a post after a digest of its inputs, so quotes sharing their first words
+# never overwrite each other
+def post_name(im_path, quote, template, disabled, fmt):
+    params = {"version": RENDER_VERSION, "template": template.digest(), "disabled": sorted(disabled),
+              "output": fmt.params()}
+    digest = post_digest(os.path.join("in", "raw", im_path), quote, template.quote["font"], None, params)
+    return post_file_name(quote, digest, fmt.ext)
+
+# Function to write an encoded post
+def save_post(data, file_name):
+    write_file(f'out/{file_name}', data)
     print(f"Output image saved as: out/{file_name}")
+    return f'out/{file_name}'
 
-def main():
+# Function to build and save the image
+def build_image(im_path, quote, include_trademark=False, include_logo=False, fmt=None, template_path=DEFAULT_TEMPLATE):
+    fmt = fmt or OutputFormat()
+    im = render_post(im_path, quote, include_trademark, include_logo, template_path)
+    file_name = post_name(im_path, quote, load_template(template_path), disabled_roles(include_logo, include_trademark),
+                          fmt)
+    return save_post(fmt.encode(im), file_name)
+
+# Function to render and encode one post in a worker process; writing happens back in the main process
+def encode_job(im_path, quote, include_trademark, include_logo, fmt, template_path, cache_dir, file_name):
+    return fmt.encode(render_post(im_path, quote, include_trademark, include_logo, template_path, cache_dir))
+
+# Function to write one render result; returns whether the post was saved
+def save_result(result):
+    im_path, quote = result.job[:2]
+    file_name = result.job[-1]
+    if result.error:
+        print(f"Failed to build {im_path} with quote: {quote} ({result.error})")
+        return False
+    save_post(result.output, file_name)
+    return True
+
+def main(workers=1, progress_interval=None, offline=None, fmt=None, template_path=DEFAULT_TEMPLATE, cache_dir=CACHE_DIR,
+         cache_mb=DISK_CACHE_MB):
     dir_paths = "in/raw"
-    im_paths = get_im_paths(dir_paths)
+    im_paths = get_im_paths(dir_paths, template_path)
     
     if not im_paths:
         print(f"No image files found in {dir_paths}. Exiting...")
@@ -146,20 +81,59 @@ def main():
     
     # Ask whether to include logo
     include_logo = input("Include logo? (y/n): ").strip().lower() == 'y'
+    fmt = fmt or OutputFormat()
+    template = load_template(template_path)
+    disabled = disabled_roles(include_logo, include_trademark)
     
     # Ensure that only the specified number of images are processed
     im_paths = im_paths[:num_quotes]  # Limit images to the number of quotes
     
-    # Generate images for each quote
-    for i, im_path in enumerate(im_paths):  # Ensure we only process the limited images
-        quote = get_random_quote()  # Fetch a new quote for each image
-        if quote:
-            print(f"Overlaying {im_path} with quote: {quote}...")
-            build_image(im_path, quote, f"{i}", include_trademark, include_logo)
-            time.sleep(2)  # Add a 2-second delay after each quote is fetched
-        else:
-            print(f"Failed to fetch a quote for {im_path}. Skipping...")
+    # Pair each quote with the next image as soon as it arrives
+    def pair(item):
+        im_path, quote = item
+        print(f"Overlaying {im_path} with quote: {quote}...")
+        file_name = post_name(im_path, quote, template, disabled, fmt)
+        return (im_path, quote, include_trademark, include_logo, fmt, template_path, cache_dir, file_name)
+
+    # Stream quotes (rate limited instead of sleeping after each quote) -> pair them with images ->
+    # render and encode on worker processes -> write on a thread, so fetching, rendering and disk
+    # writes all overlap
+    workers = resolve_workers(workers)
+    store = QuoteStore()  # Every fetched quote is kept locally for offline replay
+    quotes = iter_quotes(ForismaticSource(), len(im_paths), store=store, offline=offline)
+    pipeline = Pipeline(zip(im_paths, quotes), name="fetch")
+    pipeline.add_stage("pair", pair)
+    pipeline.add_pool_stage("render", encode_job, workers)
+    pipeline.add_stage("write", save_result)
+    if progress_interval:
+        pipeline.monitor(progress_interval)
+    results = list(pipeline.run())
+    saved, failed = results.count(True), results.count(False) + pipeline.stages[-1].errors
+    metrics.count("bulkpost_posts_total", saved, status="rendered")
+    metrics.count("bulkpost_posts_total", failed, status="failed")
+    if cache_dir:
+        prune_disk_cache(cache_dir, cache_mb)
+
+    for im_path in im_paths[pipeline.source_stage.processed:]:
+        print(f"Failed to fetch a quote for {im_path}. Skipping...")
+    print(f"Saved {saved} posts, failed {failed} ({workers} render processes)")
+    print(pipeline.format_stats())
+    if workers == 1:  # Worker processes keep their own caches
+        print(f"Asset cache: {format_stats()}")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Overlay random Forismatic quotes onto images in in/raw")
+    parser.add_argument("--workers", type=int, default=1, help="number of render processes (0 = one per core)")
+    parser.add_argument("--offline", action="store_true", default=None,
+                        help="sample quotes from the local quote store instead of the API")
+    parser.add_argument("--progress", type=float, default=None, metavar="SECONDS",
+                        help="print per-stage queue depth and throughput every SECONDS")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, help="template file describing the post layout")
+    add_format_arguments(parser)
+    add_disk_cache_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+    metrics.metrics_from_args(args)
+    main(args.workers, args.progress, args.offline, format_from_args(args), args.template,
+         None if args.no_disk_cache else CACHE_DIR, args.disk_cache_mb or DISK_CACHE_MB)
@@ -1,142 +1,66 @@
-import os
-from PIL import Image, ImageDraw, ImageFont, ImageChops, ImageEnhance
-import textwrap
-
-# Function to read quotes from a file
-def get_quotes(file_path):
+import csv
+import argparse
+from bulkpost import metrics, templates
+from bulkpost.backgrounds import CACHE_DIR, DISK_CACHE_MB, add_disk_cache_arguments, prune_disk_cache
+from bulkpost.render_engine import render_jobs, resolve_workers
+from bulkpost.manifest import BuildManifest, post_digest, post_file_name
+from bulkpost.encoders import OutputFormat, BackgroundWriter, add_format_arguments, format_from_args, write_file
+from bulkpost.assets import format_stats
+from bulkpost.templates import DEFAULT_TEMPLATE, load_template, disabled_roles
+from bulkpost.jobs import RENDER_VERSION
+from bulkpost.quote_reader import iter_quotes
+from bulkpost.memory import plan_memory, init_worker, get_frame, MemoryUsage
+from bulkpost.discovery import find_images
+from bulkpost.pairing import all_combinations, curate
+
+# Shared with batch jobs, so posts built either way are up to date for the other.
+# Everything else that changes the pixels comes from the template and its digest.
+RENDER_PARAMS = {"version": RENDER_VERSION}
+
+# Function to stream quotes from a txt, CSV or JSONL file, one at a time and without repeats
+def get_quotes(file_path, **options):
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.readlines()
-        return [quote.strip() for quote in content if quote.strip()]
-    except Exception as e:
+        yield from iter_quotes(file_path, **options)
+    except (OSError, ValueError, csv.Error) as e:
         print(f"Error reading file: {e}")
-        return []
-
-# Function to apply a tint color to the image
-def apply_tint(im, tint_color):
-    # Convert image to 'RGB' mode if not already
-    if im.mode != 'RGB':
-        im = im.convert('RGB')
-    # Create a new image with the tint color and apply the multiply blend
-    tinted_im = ImageChops.multiply(im, Image.new('RGB', im.size, tint_color))
-    # Adjust brightness for the final effect
-    tinted_im = ImageEnhance.Brightness(tinted_im).enhance(0.6)
-    return tinted_im
-
-# Function to place a logo at the bottom of the image
-def place_logo(bkg, logo, trademark, font):
-    bkg_width, bkg_height = bkg.size
-    logo_width, logo_height = logo.size
-    draw = ImageDraw.Draw(bkg)
-    text_width, text_height = draw.textbbox((0, 0), trademark, font=font)[2:]
-    spacing = 2
-    x_position = int((bkg_width - logo_width) / 2)
-    
-    # Position the logo just above the trademark text
-    y_position = bkg_height - logo_height - text_height - spacing - 10  # 10 pixels gap from text
-    
-    # Ensure the logo has an alpha channel
-    if logo.mode != "RGBA":
-        logo = logo.convert("RGBA")
-    
-    # Extract the alpha channel for transparency
-    mask = logo.split()[3]  # Use the alpha channel as the mask
-    
-    bkg.paste(logo, (x_position, y_position), mask)
-    return bkg
-
-# Function to place a trademark text at the bottom of the image
-def place_trademark(im, trademark, font):
-    draw = ImageDraw.Draw(im)
-    W, H = im.size
-    text_width, text_height = draw.textbbox((0, 0), trademark, font=font)[2:]
-    x = (W - text_width) / 2
-    y = H - text_height - 10  # 10 pixels from the bottom
-    draw.text((x, y), trademark, font=font, fill="white")
-    return im
-
-# Function to place the quote in the center of the image
-def place_quote(im, quote, font):
-    draw = ImageDraw.Draw(im)
-    W, H = im.size
-    lines = textwrap.wrap(quote, width=24)
-    n_lines = len(lines)
-    pad = -10
-    current_h = H / 2 - (n_lines * draw.textbbox((0, 0), lines[0], font=font)[3] / 2)
-    for line in lines:
-        text_width, text_height = draw.textbbox((0, 0), line, font=font)[2:]
-        draw.text(((W - text_width) / 2, current_h), line, font=font, fill="white")
-        current_h += text_height + pad
-
-# Function to check if a file path is an image
-def is_img(file_name):
-    try:
-        Image.open(file_name)
-        return True
-    except IOError:
-        return False
-
-# Function to get paths of image files from a directory
-def get_im_paths(dir_path):
-    return [os.path.join(dir_path, file) for file in os.listdir(dir_path) if is_img(os.path.join(dir_path, file))]
-
-# Function to build and save the image
-def build_image(im_path, quote, im_count='', logoify=True, trademarkify=True):
-    W = H = 1080
-    im = Image.open(im_path).resize((W, H))
-    im = apply_tint(im, (200, 200, 200))
-    draw = ImageDraw.Draw(im)
-
-    cap_font = ImageFont.truetype("utils/BebasNeue.otf", 115)
-    place_quote(im, quote, cap_font)
-
-    # Add trademark/logo if requested
-    if trademarkify:
-        trademark = "YOUR_TRADEMARK"
-        tm_font = ImageFont.truetype("utils/BebasNeue.otf", 52)
-        place_trademark(im, trademark, tm_font)
-    
-    if logoify:
-        try:
-            logo = Image.open("shelby.png")  # Replace with actual path to logo file
-
-            # Resize the logo to fit within 20% of the image width or height
-            max_logo_width = W * 0.2
-            max_logo_height = H * 0.2
 
-            logo_width, logo_height = logo.size
+# Function to get paths of image files from a directory and its subdirectories.
+# Files are checked from their headers (cached by mtime), and unreadable ones are reported up front.
+# Near-duplicates and backgrounds the quote would be hard to read on are left out.
+def get_im_paths(dir_path, template_path=DEFAULT_TEMPLATE):
+    im_paths, _ = curate(find_images(dir_path), load_template(template_path))
+    return im_paths
 
-            # Calculate the aspect ratio
-            aspect_ratio = logo_width / logo_height
-            if logo_width > logo_height:
-                if logo_width > max_logo_width:
-                    logo_width = max_logo_width
-                    logo_height = logo_width / aspect_ratio
-            else:
-                if logo_height > max_logo_height:
-                    logo_height = max_logo_height
-                    logo_width = logo_height * aspect_ratio
+# Function to render one post in memory from a template (background, quote, cached static overlay)
+def render_post(im_path, quote, logoify=True, trademarkify=True, template_path=DEFAULT_TEMPLATE, cache_dir=CACHE_DIR):
+    template = load_template(template_path)
+    return templates.render_post(im_path, quote, template, disabled_roles(logoify, trademarkify), cache_dir)
 
-            # Resize the logo to the new dimensions
-            logo = logo.resize((int(logo_width), int(logo_height)))
-
-            place_logo(im, logo, trademark, tm_font)
-        except Exception as e:
-            print(f"Error loading logo: {e}")
-
-    # Ensure output directory exists
-    if not os.path.exists("out"):
-        os.makedirs("out")
+# Function to build and save the image
+def build_image(im_path, quote, im_count='', logoify=True, trademarkify=True, out_name=None, fmt=None,
+                template_path=DEFAULT_TEMPLATE):
+    fmt = fmt or OutputFormat()
+    im = render_post(im_path, quote, logoify, trademarkify, template_path)
 
     # Save the image with a unique filename
-    im.save(f'out/{im_count}_{quote[:10]}.png')
-    print(f"Output image saved as: out/{im_count}_{quote[:10]}.png")
+    out_name = out_name or f'{im_count}_{quote[:10]}.{fmt.ext}'
+    write_file(f'out/{out_name}', fmt.encode(im))
+    print(f"Output image saved as: out/{out_name}")
+    return f'out/{out_name}'
+
+# Function to render and encode one job produced by main(); writing happens back in the main process
+def encode_job(im_path, quote, logoify, trademarkify, out_name, digest, fmt, template_path, cache_dir=CACHE_DIR):
+    template = load_template(template_path)
+    frame = get_frame(template.size)  # One reused canvas per worker instead of a new frame per post
+    return fmt.encode(templates.render_post(im_path, quote, template, disabled_roles(logoify, trademarkify),
+                                            cache_dir, frame))
 
 # Main function to orchestrate the process
-def main():
+def main(workers=1, force=False, prune=False, fmt=None, template_path=DEFAULT_TEMPLATE, quotes_path="in/quotes.txt",
+         memory_budget=None, cache_dir=CACHE_DIR, cache_mb=DISK_CACHE_MB):
     dir_path = "in/raw"
-    im_paths = get_im_paths(dir_path)
-    quotes = get_quotes("in/quotes.txt")  # Adjust the path to your quotes file
+    im_paths = get_im_paths(dir_path, template_path)
+    quotes = get_quotes(quotes_path)
 
     if not im_paths:
         print(f"No image files found in {dir_path}. Exiting...")
@@ -148,20 +72,120 @@ def main():
     include_trademark = input("Include trademark? (y/n): ").strip().lower() == 'y'
     include_logo = input("Include logo? (y/n): ").strip().lower() == 'y'
 
-    if generate_all_combinations:
-        im_count = 0
-        for im_path in im_paths:
-            for quote in quotes:
-                print(f"Overlaying {im_path} with quote: {quote}...")
-                build_image(im_path, quote, im_count, include_logo, include_trademark)
-            im_count += 1
-    else:
-        for i, im_path in enumerate(im_paths):
-            if i < len(quotes):
-                print(f"Overlaying {im_path} with quote: {quotes[i]}...")
-                build_image(im_path, quotes[i], '', include_logo, include_trademark)
-            else:
-                print(f"Skipping {im_path} as there are no more quotes available")
+    # Posts are content-addressed, so only missing or changed ones are rendered again
+    manifest = BuildManifest("out")
+    fmt = fmt or OutputFormat()
+    template = load_template(template_path)
+    params = dict(RENDER_PARAMS, template=template.digest(), disabled=sorted(disabled_roles(include_logo, include_trademark)),
+                  output=fmt.params())
+    current = set()  # Post digests of this run; tuples per post would grow with the corpus
+    skipped = 0
+
+    def pairs():
+        if generate_all_combinations:
+            yield from all_combinations(im_paths, quotes)
+        else:
+            for im_path in im_paths:
+                quote = next(quotes, None)
+                if quote is not None:
+                    yield im_path, quote
+                else:
+                    print(f"Skipping {im_path} as there are no more quotes available")
+
+    def jobs():
+        nonlocal skipped
+        for im_path, quote in pairs():
+            digest = post_digest(im_path, quote, template.quote["font"], None, params)
+            if digest in current:  # Identical inputs earlier in this run, e.g. a copied background
+                skipped += 1
+                metrics.count("bulkpost_posts_total", status="duplicate")
+                continue
+            current.add(digest)
+            if not force and manifest.is_fresh(digest):
+                skipped += 1
+                metrics.count("bulkpost_posts_total", status="up_to_date")
+                continue
+            print(f"Overlaying {im_path} with quote: {quote}...")
+            yield (im_path, quote, include_logo, include_trademark, post_file_name(quote, digest, fmt.ext), digest, fmt,
+                   template_path, cache_dir)
+
+    # Render and encode the jobs, spreading them over worker processes when requested,
+    # while a writer thread puts the encoded bytes on disk. A memory budget caps the workers,
+    # their background caches and the posts in flight.
+    plan = plan_memory(memory_budget, resolve_workers(workers), template.size)
+    usage = MemoryUsage(plan)
+    progress = metrics.Progress()
+    rendered = failed = 0
+    with BackgroundWriter(plan.in_flight) as writer:
+        for result in render_jobs(encode_job, jobs(), plan.workers, init_worker, (plan.max_cached,), plan.in_flight):
+            usage.observe(result)
+            im_path, quote, _, _, out_name, digest, _, _, _ = result.job
+            if result.error:
+                failed += 1
+                print(f"Failed to build {im_path} with quote: {quote} ({result.error})")
+                metrics.count("bulkpost_posts_total", status="failed")
+                metrics.event("post_failed", image=im_path, quote=quote, error=result.error)
+                progress.update(rendered, failed, skipped)
+                continue
+            writer.write(f'out/{out_name}', result.output)
+            print(f"Output image saved as: out/{out_name}")
+            rendered += 1
+            metrics.count("bulkpost_posts_total", status="rendered")
+            metrics.event("post_rendered", image=im_path, quote=quote, file=out_name, digest=digest,
+                          bytes=len(result.output))
+            progress.update(rendered, failed, skipped)
+            manifest.record(digest, out_name, im_path, quote)
+            if rendered % 100 == 0:
+                manifest.save()  # Keep progress if the run is interrupted
+                if cache_dir:
+                    prune_disk_cache(cache_dir, cache_mb)
+
+    # Posts whose file could not be written were not built after all
+    for path, error in writer.errors:
+        manifest.forget_file(path)
+    rendered -= len(writer.errors)
+    failed += len(writer.errors)
+    metrics.count("bulkpost_posts_total", len(writer.errors), status="write_failed")
+
+    stale = manifest.stale(current)
+    if prune and stale:
+        for file_name in manifest.prune(current):
+            print(f"Removed stale post: out/{file_name}")
+    elif stale:
+        print(f"{len(stale)} stale posts in out/ no longer match any input (run with --prune to remove them)")
+    manifest.save()
+    if cache_dir:
+        prune_disk_cache(cache_dir, cache_mb)
+    progress.update(rendered, failed, skipped, final=True)
+    print(f"Rendered {rendered}, up to date {skipped}, failed {failed}")
+    report = usage.report()
+    print(f"Peak memory: {report['total_peak_mb']} MB" +
+          (f" of a {memory_budget} MB budget" if memory_budget else "") +
+          f" ({plan.workers} workers, {plan.max_cached} cached backgrounds each, {plan.in_flight} posts in flight)")
+
+    # Worker processes keep their own registries, so counters are only meaningful in-process
+    if plan.workers == 1:
+        print(f"Asset cache: {format_stats()}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Overlay quotes from in/quotes.txt onto images in in/raw")
+    parser.add_argument("--workers", type=int, default=1, help="number of render processes (0 = one per core)")
+    parser.add_argument("--force", action="store_true", help="render every post even if it is up to date")
+    parser.add_argument("--prune", action="store_true", help="delete posts whose inputs are gone")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, help="template file describing the post layout")
+    parser.add_argument("--quotes", default="in/quotes.txt", help="quote file: one per line, or CSV/JSONL with a quote column")
+    parser.add_argument("--memory-budget", type=float, metavar="MB",
+                        help="peak memory for the whole run; sets workers, background cache and in-flight posts")
+    add_format_arguments(parser)
+    add_disk_cache_arguments(parser)
+    metrics.add_metrics_arguments(parser, progress=True)
+    args = parser.parse_args()
+    if args.memory_budget:
+        # Checked before the prompts rather than after them
+        try:
+            plan_memory(args.memory_budget, resolve_workers(args.workers), load_template(args.template).size)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    metrics.metrics_from_args(args)
+    main(args.workers, args.force, args.prune, format_from_args(args), args.template, args.quotes, args.memory_budget,
+         None if args.no_disk_cache else CACHE_DIR, args.disk_cache_mb or DISK_CACHE_MB)